@@ -96,3 +96,21 @@ USE_I18N = True
 USE_L10N = True
 
 USE_TZ = True
+
+
+# DailySummary panel and snapshot cache used by the analyzers
+
+SUMMARY_PANEL_DIR = os.getenv('SUMMARY_PANEL_DIR', f'{BASE_DIR}/data/panel')
+
+SUMMARY_SNAPSHOT_CACHE_BYTES = int(os.getenv('SUMMARY_SNAPSHOT_CACHE_BYTES', 256 * 1024 * 1024))
+
+SUMMARY_SNAPSHOT_CACHE_TTL = int(os.getenv('SUMMARY_SNAPSHOT_CACHE_TTL', 5 * 60))
+
+
+# Raw crawler responses of past dates, served without network when offline
+
+CRAWLER_CACHE_DIR = os.getenv('CRAWLER_CACHE_DIR', f'{BASE_DIR}/data/crawler')
+
+CRAWLER_OFFLINE = os.getenv('CRAWLER_OFFLINE', 'false').lower() == 'true'
+
+STOCK_DIRECTORY_TTL = int(os.getenv('STOCK_DIRECTORY_TTL', 24 * 60 * 60))
@@ -0,0 +1,142 @@
+import logging
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+from stocks.models import BackTestRecord
+
+logger = logging.getLogger(__name__)
+
+
+class BackTestAnalytics:
+    # Trades and performance metrics of back test commits. Records are paired per (commit, stock): a trade opens
+    # when the position leaves zero and closes when it returns there, so every step works on sorted arrays.
+    RECORD_KEYS = ('commit', 'stock_id', 'ts', 'price', 'volume')
+
+    def __init__(self, records: pd.DataFrame):
+        self._records = records.sort_values(['commit', 'stock_id', 'ts'], kind='mergesort', ignore_index=True)
+        self._trades = None
+
+    @classmethod
+    def load(cls, commits: Sequence[str]):
+        record_qs = BackTestRecord.objects.filter(commit__in=commits).values_list(*cls.RECORD_KEYS)
+        records = pd.DataFrame.from_records(data=record_qs, columns=cls.RECORD_KEYS)
+        records['ts'] = pd.to_datetime(records['ts'], utc=True)
+        records['price'] = records['price'].astype(float)
+        records['volume'] = records['volume'].astype(np.int64)
+        logger.info(f'{len(records)} back test records of {len(commits)} commits loaded')
+        return cls(records)
+
+    @property
+    def records(self) -> pd.DataFrame:
+        return self._records
+
+    @property
+    def trades(self) -> pd.DataFrame:
+        if self._trades is None:
+            self._trades = self.pair_trades(self._records)
+        return self._trades
+
+    @staticmethod
+    def pair_trades(records: pd.DataFrame) -> pd.DataFrame:
+        columns = ['commit', 'stock_id', 'entry_ts', 'exit_ts', 'volume', 'cost', 'proceeds', 'is_closed', 'pnl',
+                   'return']
+        if records.empty:
+            return pd.DataFrame(columns=columns)
+
+        volumes = records['volume'].to_numpy()
+        prices = records['price'].to_numpy()
+        group_codes = records.groupby(['commit', 'stock_id'], sort=False).ngroup().to_numpy()
+        positions = pd.Series(volumes).groupby(group_codes).cumsum().to_numpy()
+        is_opening = (positions - volumes) == 0
+        starts = np.flatnonzero(is_opening)
+        ends = np.r_[starts[1:], len(records)] - 1
+
+        values = prices * volumes
+        cost = np.add.reduceat(np.where(volumes > 0, values, 0.0), starts)
+        proceeds = -np.add.reduceat(np.where(volumes < 0, values, 0.0), starts)
+        # a trade opened by a sell, e.g. one closing a position carried from another stock, is left open
+        is_closed = (positions[ends] == 0) & (volumes[starts] > 0)
+        pnl = np.where(is_closed, proceeds - cost, np.nan)
+        trades = pd.DataFrame({
+            'commit': records['commit'].to_numpy()[starts],
+            'stock_id': records['stock_id'].to_numpy()[starts],
+            'entry_ts': records['ts'].to_numpy()[starts],
+            'exit_ts': records['ts'].to_numpy()[ends],
+            'volume': np.add.reduceat(np.where(volumes > 0, volumes, 0), starts),
+            'cost': cost,
+            'proceeds': proceeds,
+            'is_closed': is_closed,
+            'pnl': pnl,
+            'return': pnl / np.where(cost > 0, cost, np.nan),
+        })
+        trades['entry_ts'] = pd.to_datetime(trades['entry_ts'], utc=True)
+        trades['exit_ts'] = pd.to_datetime(trades['exit_ts'], utc=True)
+        return trades[columns]
+
+    @staticmethod
+    def get_equity_curves(trades: pd.DataFrame) -> pd.DataFrame:
+        # realized equity and drawdown of each commit at the exit of every closed trade
+        closed = trades[trades['is_closed']].sort_values(['commit', 'exit_ts'], kind='mergesort')
+        equity = closed['pnl'].groupby(closed['commit']).cumsum()
+        peak = np.maximum(equity.groupby(closed['commit']).cummax(), 0)
+        return pd.DataFrame({
+            'commit': closed['commit'],
+            'ts': closed['exit_ts'],
+            'equity': equity,
+            'drawdown': peak - equity,
+        })
+
+    @staticmethod
+    def get_invested_curves(trades: pd.DataFrame) -> pd.DataFrame:
+        # capital held in open trades of each commit after every entry and exit
+        entries = pd.DataFrame({'commit': trades['commit'], 'ts': trades['entry_ts'], 'change': trades['cost']})
+        closed = trades[trades['is_closed']]
+        exits = pd.DataFrame({'commit': closed['commit'], 'ts': closed['exit_ts'], 'change': -closed['cost']})
+        # exits come first on ties, so that back to back trades do not look held at once
+        events = (pd.concat([exits, entries], ignore_index=True)
+                  .sort_values(['commit', 'ts'], kind='mergesort'))
+        events['invested'] = events['change'].groupby(events['commit']).cumsum()
+        return events[['commit', 'ts', 'invested']]
+
+    @staticmethod
+    def get_time_in_market(trades: pd.DataFrame) -> pd.Series:
+        # length of the union of trade durations over the span of each commit's trades
+        intervals = trades.sort_values(['commit', 'entry_ts'], kind='mergesort')
+        entry_ts, exit_ts = intervals['entry_ts'], intervals['exit_ts']
+        covered_until = exit_ts.groupby(intervals['commit']).cummax().groupby(intervals['commit']).shift()
+        covered_from = entry_ts.where(covered_until.isna() | (entry_ts > covered_until), covered_until)
+        covered = (exit_ts - covered_from).clip(lower=pd.Timedelta(0))
+        by_commit = intervals.groupby('commit')
+        span = by_commit['exit_ts'].max() - by_commit['entry_ts'].min()
+        return covered.groupby(intervals['commit']).sum() / span.where(span > pd.Timedelta(0))
+
+    def summarize(self) -> pd.DataFrame:
+        # metrics (rows) of every commit (columns)
+        trades = self.trades
+        if trades.empty:
+            return pd.DataFrame()
+        closed = trades[trades['is_closed']]
+        by_commit = closed.groupby('commit')
+        gross_profit = closed['pnl'].clip(lower=0).groupby(closed['commit']).sum()
+        gross_loss = -closed['pnl'].clip(upper=0).groupby(closed['commit']).sum()
+        equity_curves = self.get_equity_curves(trades)
+        invested_curves = self.get_invested_curves(trades)
+
+        summary = pd.DataFrame({
+            'records': self._records.groupby('commit').size(),
+            'trades': by_commit.size(),
+            'open_trades': (~trades['is_closed']).groupby(trades['commit']).sum(),
+            'win_rate': (closed['pnl'] > 0).groupby(closed['commit']).mean(),
+            'total_pnl': by_commit['pnl'].sum(),
+            'average_pnl': by_commit['pnl'].mean(),
+            'average_return': by_commit['return'].mean(),
+            'profit_factor': gross_profit / gross_loss.where(gross_loss > 0),
+            'max_drawdown': equity_curves.groupby('commit')['drawdown'].max(),
+            'average_holding': (closed['exit_ts'] - closed['entry_ts']).groupby(closed['commit']).mean(),
+            'max_invested': invested_curves.groupby('commit')['invested'].max(),
+            'time_in_market': self.get_time_in_market(trades),
+        })
+        summary['trades'] = summary['trades'].fillna(0).astype(int)
+        return summary.T
@@ -1,12 +1,18 @@
 import logging
 from typing import Tuple
 
+import numpy as np
 import pandas as pd
 from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
 import talib
 from dateutil.tz import gettz
 from django.db import models
 
+from stocks.helpers import indicator as indicators
+from stocks.helpers.investor import InvestorStreak
+from stocks.helpers.panel import SummaryPanel
+from stocks.helpers.snapshot import snapshot_cache
 from stocks.models import DailySummary, Exchange, Stock
 
 logger = logging.getLogger(__name__)
@@ -16,15 +22,35 @@ class Analyzer:
 
     def __init__(self, exchange):
         self._exchange = exchange
+        self._panel = SummaryPanel(exchange)
 
     @property
     def calendar(self):
         return self.exchange.calendar
 
+    @property
+    def calendar_index(self):
+        return self.exchange.calendar_index
+
     @property
     def exchange(self):
         return self._exchange
 
+    @property
+    def panel(self) -> SummaryPanel:
+        return self._panel
+
+    @property
+    def timezone(self) -> str:
+        # read from the brokerage class, so that workers never log in only to localize timestamps
+        return self.exchange.get_stock_brokerage_class(self.exchange.code).TIMEZONE
+
+    def get_summary_snapshot(self, date, fields) -> pd.DataFrame:
+        snapshot = self.panel.read_filled_snapshot(date, fields)
+        if snapshot is not None:
+            return snapshot
+        return snapshot_cache.get(self.exchange, date)[list(fields)]
+
     def get_stocks(self) -> pd.DataFrame:
         pass
 
@@ -39,31 +65,75 @@ class Analyzer:
         return to_offset(interval) >= to_offset('1D')
 
     @staticmethod
-    def ticks_to_kbars(ticks: pd.DataFrame, interval='1Min'):
-        kbars = pd.DataFrame()
-
-        kbars['open'] = ticks['close'].resample(interval).first()
-        kbars['close'] = ticks['close'].resample(interval).last()
-        kbars['high'] = ticks['close'].resample(interval).max()
-        kbars['low'] = ticks['close'].resample(interval).min()
-        kbars['volume'] = ticks['volume'].resample(interval).sum()
-
+    def aggregate_kbars(bars: pd.DataFrame, interval='1Min') -> pd.DataFrame:
+        # OHLCV aggregation of time-ordered bars (or ticks with every price column set to the trade price) in one
+        # binning pass; bars of fixed intervals dividing a day are reduced at the bin boundaries instead of
+        # resampling every column. Other intervals are resampled, since their bins start from the first day
+        # instead of the epoch `floor` counts from.
+        columns = ['open', 'close', 'high', 'low', 'volume']
+        offset = to_offset(interval)
+        if bars.empty:
+            return pd.DataFrame(columns=columns, index=bars.index[:0])
+        if not isinstance(offset, Tick) or pd.Timedelta(days=1).value % offset.nanos != 0:
+            aggregate_map = {'open': 'first', 'close': 'last', 'high': 'max', 'low': 'min', 'volume': 'sum'}
+            return bars.resample(interval).agg(aggregate_map)[columns].dropna()
+
+        labels = bars.index.floor(offset)
+        label_values = labels.asi8
+        starts = np.flatnonzero(np.r_[True, label_values[1:] != label_values[:-1]])
+        ends = np.r_[starts[1:], len(label_values)] - 1
+        volume = bars['volume'].to_numpy()
+        if volume.dtype.kind == 'f':
+            volume = np.nan_to_num(volume)
+        kbars = pd.DataFrame({
+            'open': bars['open'].to_numpy(dtype=float)[starts],
+            'close': bars['close'].to_numpy(dtype=float)[ends],
+            'high': np.fmax.reduceat(bars['high'].to_numpy(dtype=float), starts),
+            'low': np.fmin.reduceat(bars['low'].to_numpy(dtype=float), starts),
+            'volume': np.add.reduceat(volume, starts),
+        }, index=labels[starts].rename(bars.index.name))
         return kbars.dropna()
 
+    @classmethod
+    def ticks_to_kbars(cls, ticks: pd.DataFrame, interval='1Min'):
+        if ticks.empty:
+            return cls.aggregate_kbars(ticks, interval=interval)
+        bars = pd.DataFrame({
+            'open': ticks['close'],
+            'close': ticks['close'],
+            'high': ticks['close'],
+            'low': ticks['close'],
+            'volume': ticks['volume'],
+        })
+        return cls.aggregate_kbars(bars, interval=interval)
+
+    @classmethod
+    def ticks_to_kbar_pyramid(cls, ticks: pd.DataFrame, intervals=('1Min', '5Min', '15Min', '60Min')) -> dict:
+        # only the finest interval is built from ticks, every coarser one from the finest level dividing it
+        pyramid = {}
+        for interval in sorted(intervals, key=to_offset):
+            offset = to_offset(interval)
+            finer_intervals = [finer for finer in pyramid
+                               if isinstance(offset, Tick) and offset.nanos % to_offset(finer).nanos == 0]
+            if finer_intervals:
+                pyramid[interval] = cls.aggregate_kbars(pyramid[finer_intervals[-1]], interval=interval)
+            else:
+                pyramid[interval] = cls.ticks_to_kbars(ticks, interval=interval)
+        return pyramid
+
     def daily_summaries_to_kbars(self, daily_summaries, interval='1D'):
-        timezone = self.exchange.brokerage.TIMEZONE
-        kbars = pd.DataFrame()
+        timezone = self.timezone
         summaries = pd.DataFrame.from_records(data=daily_summaries)
         summaries['ts'] = pd.to_datetime(summaries['date']).dt.tz_localize(timezone)
-        summaries = summaries.set_index(['ts'])
+        summaries = summaries.set_index(['ts']).rename(columns={
+            'opening_price': 'open',
+            'closing_price': 'close',
+            'highest_price': 'high',
+            'lowest_price': 'low',
+            'trade_volume': 'volume',
+        })
 
-        kbars['open'] = summaries['opening_price'].resample(interval).first()
-        kbars['close'] = summaries['closing_price'].resample(interval).last()
-        kbars['high'] = summaries['highest_price'].resample(interval).max()
-        kbars['low'] = summaries['lowest_price'].resample(interval).min()
-        kbars['volume'] = summaries['trade_volume'].resample(interval).sum()
-
-        return kbars.dropna()
+        return self.aggregate_kbars(summaries, interval=interval)
 
     def save_plot(self, plot_title, kbars):
         pass
@@ -75,6 +145,7 @@ class Analyzer:
 class TwseAnalyzer(Analyzer):
     MIN_RSI = 30
     MAX_RSI = 70
+    INDICATOR_LOOKBACK_DAYS = 80
 
     def __init__(self):
         super().__init__(Exchange.objects.get(code='TWSE'))
@@ -84,37 +155,79 @@ class TwseAnalyzer(Analyzer):
         return pd.DataFrame.from_records(data=stocks)
 
     def get_date_open_duration(self, date):
-        timezone = self._exchange.brokerage.TIMEZONE
+        timezone = self.timezone
         return {
             'open': pd.to_datetime(date.strftime('%Y-%m-%dT09:00:00')).tz_localize(timezone),
             'close': pd.to_datetime(date.strftime('%Y-%m-%dT13:30:00')).tz_localize(timezone),
         }
 
-    def get_kbars(self, stock, from_ts, to_ts, interval='1Min'):
-        brokerage = self.exchange.brokerage
+    def get_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
+        sessions = self.calendar_index.get_sessions(from_ts.normalize(), to_ts)
+        durations = [self.get_date_open_duration(session) for session in sessions]
+        # the brokerage logs in only when some session has to be fetched
+        brokerage_cls = self.exchange.get_stock_brokerage_class(self.exchange.code)
+        ticks, missing_durations = brokerage_cls.load_stored_ranged_ticks(stock, durations)
+        if not missing_durations:
+            return ticks
+        fetched = self.exchange.brokerage.fetch_ranged_ticks(stock, missing_durations)
+        return pd.concat([ticks, fetched]).sort_index(kind='mergesort')
+
+    def get_materialized_kbars(self, stock, from_ts, to_ts) -> pd.DataFrame:
+        # stored bars of the materialized interval; sessions without any are built from ticks and stored
+        brokerage_cls = self.exchange.get_stock_brokerage_class(self.exchange.code)
+        sessions = self.calendar_index.get_sessions(from_ts.normalize(), to_ts)
+        durations = [self.get_date_open_duration(session) for session in sessions]
+        if not durations:
+            return self.ticks_to_kbars(pd.DataFrame(columns=brokerage_cls.TICK_KEYS).set_index('ts'))
+        stored = brokerage_cls.load_stored_kbars(stock, durations[0]['open'], durations[-1]['close'])
+        starts = stored.index.searchsorted(pd.DatetimeIndex([duration['open'] for duration in durations]), side='left')
+        ends = stored.index.searchsorted(pd.DatetimeIndex([duration['close'] for duration in durations]), side='right')
+
+        missing_durations = [duration for duration, start, end in zip(durations, starts, ends) if end == start]
+        if not missing_durations:
+            return stored
+        ticks, unstored_durations = brokerage_cls.load_stored_ranged_ticks(stock, missing_durations)
+        frames = [stored]
+        if not ticks.empty:
+            frames.append(brokerage_cls.store_kbars(stock.kbars.model, stock.id, ticks))
+        if unstored_durations:
+            # bars of fetched sessions are stored by the brokerage along with their ticks
+            fetched = self.exchange.brokerage.fetch_ranged_ticks(stock, unstored_durations)
+            frames.append(self.ticks_to_kbars(fetched, interval=brokerage_cls.KBAR_INTERVAL))
+        frames = [frame for frame in frames if not frame.empty]
+        if len(frames) < 2:
+            return frames[0] if frames else stored
+        return pd.concat(frames).sort_index(kind='mergesort')
+
+    def get_is_interval_materialized(self, interval):
+        brokerage_cls = self.exchange.get_stock_brokerage_class(self.exchange.code)
+        offset, materialized_offset = to_offset(interval), to_offset(brokerage_cls.KBAR_INTERVAL)
+        return isinstance(offset, Tick) and offset.nanos % materialized_offset.nanos == 0
 
-        ticks = pd.DataFrame()
+    def get_kbars(self, stock, from_ts, to_ts, interval='1Min'):
         if self.get_is_interval_over_a_day(interval):
             daily_summaries = (stock.daily_summaries
                                .filter(date__gte=from_ts, date__lte=to_ts)
                                .values('date', 'trade_volume', 'opening_price', 'closing_price',
                                        'highest_price', 'lowest_price'))
             return self.daily_summaries_to_kbars(daily_summaries, interval=interval)
+        elif self.get_is_interval_materialized(interval):
+            return self.aggregate_kbars(self.get_materialized_kbars(stock, from_ts, to_ts), interval=interval)
         else:
-            for date in pd.date_range(from_ts, to_ts, freq='D'):
-                duration = self.get_date_open_duration(date)
-                ticks = ticks.append(brokerage.get_ticks(stock, duration['open'], duration['close']))
-            return self.ticks_to_kbars(ticks, interval=interval)
+            return self.ticks_to_kbars(self.get_ticks(stock, from_ts, to_ts), interval=interval)
+
+    def get_kbar_pyramid(self, stock, from_ts, to_ts, intervals=('1Min', '5Min', '15Min', '60Min')) -> dict:
+        return self.ticks_to_kbar_pyramid(self.get_ticks(stock, from_ts, to_ts), intervals=intervals)
 
     def get_technical_indicator_filled_kbars(self, stock, from_ts, to_ts, interval='1Min'):
-        calendar = self.calendar
+        calendar_index = self.calendar_index
         date_only_from_ts = from_ts.replace(hour=0, minute=0, second=0, microsecond=0)
         if self.get_is_interval_over_a_day(interval):
-            # FIXME: remove magic number
-            kbar_from_ts = calendar.opens[:date_only_from_ts][-80]
+            kbar_from_ts = calendar_index.get_opens(
+                calendar_index.shift(date_only_from_ts, 1 - self.INDICATOR_LOOKBACK_DAYS))
             data_filter_from_ts = date_only_from_ts
         else:
-            kbar_from_ts = calendar.opens[:date_only_from_ts][-1]
+            kbar_from_ts = calendar_index.get_opens(calendar_index.shift(date_only_from_ts, 0))
             data_filter_from_ts = from_ts
         kbars = self.get_kbars(stock, kbar_from_ts, to_ts, interval=interval)
 
@@ -128,13 +241,32 @@ class TwseAnalyzer(Analyzer):
         result = pd.concat(total_series, axis='columns')[data_filter_from_ts:to_ts]
         return result.dropna()
 
+    def get_closing_price_panel(self, from_ts, to_ts) -> pd.DataFrame:
+        # daily closing prices of every stock (date x stock_id) with the same lookback as
+        # `get_technical_indicator_filled_kbars`, so that indicators can be computed for all stocks at once
+        timezone = self.timezone
+        date_only_from_ts = from_ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        panel_from_ts = self.calendar_index.get_opens(
+            self.calendar_index.shift(date_only_from_ts, 1 - self.INDICATOR_LOOKBACK_DAYS))
+        frames = self.panel.read_filled_range(['closing_price'], panel_from_ts, to_ts)
+        if frames is not None:
+            panel = frames['closing_price']
+            return panel.set_axis(panel.index.tz_localize(timezone).rename('ts'), axis='index')
+
+        summary_qs = (DailySummary.objects
+                      .filter(date__gte=panel_from_ts, date__lte=to_ts)
+                      .values_list('date', 'stock_id', 'closing_price'))
+        summaries = pd.DataFrame.from_records(data=summary_qs, columns=['date', 'stock_id', 'closing_price'])
+        summaries['ts'] = pd.to_datetime(summaries['date']).dt.tz_localize(timezone)
+        return summaries.pivot(index='ts', columns='stock_id', values='closing_price').sort_index()
+
     def setup_plot(self, plot_title, kbars):
         import finplot as fplt
 
         kbars = kbars.reset_index().rename(columns={'ts': 'time'})
 
         # adopt TWSE style
-        fplt.display_timezone = gettz(self._exchange.brokerage.TIMEZONE)
+        fplt.display_timezone = gettz(self.timezone)
         fplt.candle_bull_color = '#ef5350'
         fplt.candle_bull_body_color = fplt.candle_bull_color
         fplt.candle_bear_color = '#26a69a'
@@ -168,61 +300,54 @@ class TwseAnalyzer(Analyzer):
         fplt.autoviewrestore()
         fplt.show()
 
-    @staticmethod
-    def get_price_filter(df: pd.DataFrame, date, min_price=0.0, max_price=999999.0) -> Tuple[pd.Series, pd.Series]:
-        summary_qs = (DailySummary.objects
-                      .filter(date=date)
-                      .values('stock_id', 'closing_price'))
-        snapshot = (pd.DataFrame
-                    .from_records(data=summary_qs)
+    def get_price_filter(self, df: pd.DataFrame, date,
+                         min_price=0.0, max_price=999999.0) -> Tuple[pd.Series, pd.Series]:
+        snapshot = (self.get_summary_snapshot(date, ['closing_price'])
                     .rename(columns={'closing_price': 'price'}))
-        summary = df.join(snapshot.set_index('stock_id'), on='id')
+        summary = df.join(snapshot, on='id')
 
         return (summary['price'] >= min_price) & (summary['price'] <= max_price), summary['price']
 
-    @staticmethod
-    def get_trade_volume_filter(df: pd.DataFrame, date, min_volume=0) -> Tuple[pd.Series, pd.Series]:
-        summary_qs = (DailySummary.objects
-                      .filter(date=date)
-                      .values('stock_id', 'trade_volume'))
-        snapshot = pd.DataFrame.from_records(data=summary_qs)
-        summary = df.join(snapshot.set_index('stock_id'), on='id')
+    def get_trade_volume_filter(self, df: pd.DataFrame, date, min_volume=0) -> Tuple[pd.Series, pd.Series]:
+        snapshot = self.get_summary_snapshot(date, ['trade_volume'])
+        summary = df.join(snapshot, on='id')
 
         return summary['trade_volume'] >= min_volume, summary['trade_volume']
 
-    @staticmethod
-    def get_amplitude_filter(df: pd.DataFrame, from_ts, to_ts, min_amplitude=0.0) -> Tuple[pd.Series, pd.Series]:
-        raw = (DailySummary.objects
-               .filter(date__gte=from_ts, date__lte=to_ts)
-               .values('stock')
-               .annotate(lowest_price=models.Min('lowest_price'),
-                         highest_price=models.Max('highest_price')))
-        summary = pd.DataFrame.from_records(data=raw)
+    def get_amplitude_filter(self, df: pd.DataFrame, from_ts, to_ts,
+                             min_amplitude=0.0) -> Tuple[pd.Series, pd.Series]:
+        frames = self.panel.read_filled_range(['lowest_price', 'highest_price'], from_ts, to_ts)
+        if frames is not None:
+            summary = pd.DataFrame({
+                'lowest_price': frames['lowest_price'].min(),
+                'highest_price': frames['highest_price'].max(),
+            }).dropna(how='all')
+        else:
+            raw = (DailySummary.objects
+                   .filter(date__gte=from_ts, date__lte=to_ts)
+                   .values('stock')
+                   .annotate(lowest_price=models.Min('lowest_price'),
+                             highest_price=models.Max('highest_price')))
+            summary = pd.DataFrame.from_records(data=raw).set_index('stock')
         lowest_price_series = summary['lowest_price']
         highest_price_series = summary['highest_price']
         summary['amplitude'] = \
             (highest_price_series - lowest_price_series) / (highest_price_series + lowest_price_series)
-        ordered_summary = df.join(summary.set_index('stock'), on='id')
+        ordered_summary = df.join(summary, on='id')
 
         return ordered_summary['amplitude'] >= min_amplitude, ordered_summary['amplitude']
 
     def get_price_change_rate_filter(self, df: pd.DataFrame, date,
                                      min_change_rate=0.0, trading_days=1) -> Tuple[pd.Series, pd.Series]:
-        # noinspection PyArgumentList
-        base_date = self.calendar.opens[:date][-(trading_days + 1)]
-
-        def get_summary_qs(d):
-            return DailySummary.objects.filter(date=d).values('stock_id', 'closing_price')
+        base_date = self.calendar_index.get_opens(self.calendar_index.shift(date, -trading_days))
 
-        snapshot = (pd.DataFrame
-                    .from_records(data=get_summary_qs(base_date))
+        snapshot = (self.get_summary_snapshot(base_date, ['closing_price'])
                     .rename(columns={'closing_price': 'price'}))
-        changed_snapshot = (pd.DataFrame
-                            .from_records(data=get_summary_qs(date))
+        changed_snapshot = (self.get_summary_snapshot(date, ['closing_price'])
                             .rename(columns={'closing_price': 'changed_price'}))
 
-        summary = df.join(snapshot.set_index('stock_id'), on='id')
-        summary = summary.join(changed_snapshot.set_index('stock_id'), on='id')
+        summary = df.join(snapshot, on='id')
+        summary = summary.join(changed_snapshot, on='id')
 
         change_rate_series = (summary['changed_price'] - summary['price']) / summary['price']
         change_rate_series.name = 'price_change_rate'
@@ -232,19 +357,14 @@ class TwseAnalyzer(Analyzer):
 
     def get_volume_change_rate_filter(self, df: pd.DataFrame, date,
                                       min_change_rate=0.0, trading_days=1) -> Tuple[pd.Series, pd.Series]:
-        # noinspection PyArgumentList
-        base_date = self.calendar.opens[:date][-(trading_days + 1)]
-
-        def get_summary_qs(d):
-            return DailySummary.objects.filter(date=d).values('stock_id', 'trade_volume')
+        base_date = self.calendar_index.get_opens(self.calendar_index.shift(date, -trading_days))
 
-        snapshot = pd.DataFrame.from_records(data=get_summary_qs(base_date))
-        changed_snapshot = (pd.DataFrame
-                            .from_records(data=get_summary_qs(date))
+        snapshot = self.get_summary_snapshot(base_date, ['trade_volume'])
+        changed_snapshot = (self.get_summary_snapshot(date, ['trade_volume'])
                             .rename(columns={'trade_volume': 'changed_trade_volume'}))
 
-        summary = df.join(snapshot.set_index('stock_id'), on='id')
-        summary = summary.join(changed_snapshot.set_index('stock_id'), on='id')
+        summary = df.join(snapshot, on='id')
+        summary = summary.join(changed_snapshot, on='id')
 
         change_rate_series = (summary['changed_trade_volume'] - summary['trade_volume']) / summary['trade_volume']
         change_rate_series.name = 'volume_change_rate'
@@ -252,25 +372,83 @@ class TwseAnalyzer(Analyzer):
 
         return change_rate_filter, change_rate_series
 
+    def get_investor_window(self, date, trading_days, keys) -> Tuple[pd.DataFrame, dict]:
+        # (day x stock) frames of whether a stock is traded and of the given investor fields over the last
+        # `trading_days` sessions up to `date`
+        last_n_days = self.calendar_index.get_opens(self.calendar_index.window(date, trading_days))
+        first_day, last_day = last_n_days[0], last_n_days[-1]
+        frames = self.panel.read_filled_range(['trade_volume', *keys], first_day, last_day)
+        if frames is not None:
+            return frames['trade_volume'].notna(), {key: frames[key] for key in keys}
+
+        # days without a summary row are ignored like untraded days of the panel
+        snapshots = [snapshot_cache.get(self.exchange, day)[list(keys)] for day in last_n_days]
+        snapshot = pd.concat(snapshots, keys=range(len(snapshots)), names=['day', 'stock_id'])
+        is_traded = (pd.Series(True, index=snapshot.index)
+                     .unstack('stock_id', fill_value=False)
+                     .reindex(range(len(snapshots)), fill_value=False))
+        values = {key: snapshot[key].astype(float).unstack('stock_id').reindex(index=is_traded.index,
+                                                                                columns=is_traded.columns)
+                  for key in keys}
+        return is_traded, values
+
+    def get_investor_continuous_buy_sweep(self, df: pd.DataFrame, date, investors_options,
+                                          trading_days_options) -> dict:
+        # Filters and total volumes of every (investors, trading days) combination, all evaluated on the window
+        # of the longest trading days. Investors pass when they net bought on every traded session of the window;
+        # sessions a stock is not traded on are ignored.
+        all_investors = [investor for investor in InvestorStreak.INVESTORS
+                         if any(investor in investors for investors in investors_options)]
+        single_investors = [investors[0] for investors in investors_options if len(investors) == 1]
+        keys = [*[InvestorStreak.get_net_volume_key(investor) for investor in all_investors],
+                *[InvestorStreak.get_buy_streak_key(investor) for investor in single_investors]]
+        is_traded, window = self.get_investor_window(date, max(trading_days_options), keys)
+        is_traded_values = is_traded.to_numpy(dtype=bool)
+        window_values = {key: values.to_numpy(dtype=float) for key, values in window.items()}
+        # stocks out of the window take the -1 position, i.e. the sentinel appended to every result
+        positions = is_traded.columns.get_indexer(df['id'])
+        stock_positions = np.arange(is_traded_values.shape[1])
+
+        results = {}
+        for trading_days in trading_days_options:
+            is_day_traded = is_traded_values[-trading_days:]
+            is_window_traded = is_day_traded.any(axis=0)
+            traded_days = is_day_traded.sum(axis=0)
+            last_traded_day = trading_days - 1 - np.argmax(is_day_traded[::-1], axis=0)
+            for investors in investors_options:
+                net_volume_keys = [InvestorStreak.get_net_volume_key(investor) for investor in investors]
+                total_volume = sum(window_values[key][-trading_days:] for key in net_volume_keys)
+                if len(investors) == 1:
+                    # streaks are carried over untraded sessions, so the precomputed one of the last traded
+                    # session has to cover every traded session of the window
+                    streaks = window_values[InvestorStreak.get_buy_streak_key(investors[0])][-trading_days:]
+                    is_buy = is_window_traded & (streaks[last_traded_day, stock_positions] >= traded_days)
+                else:
+                    is_buy = is_window_traded & ((total_volume > 0) | ~is_day_traded).all(axis=0)
+                window_total_volume = np.nansum(np.where(is_day_traded, total_volume, np.nan), axis=0)
+                window_total_volume[~is_window_traded] = np.nan
+
+                results[(tuple(investors), trading_days)] = (
+                    pd.Series(np.append(is_buy, False)[positions], index=df.index),
+                    pd.Series(np.append(window_total_volume, np.nan)[positions],
+                              index=df.index, name='investor_total_volume'),
+                )
+        return results
+
     def get_investor_continuous_buy_filter(self, df: pd.DataFrame, date,
                                            investors=('foreign_dealer', 'investment_trust', 'local_dealer_proprietary'),
                                            trading_days=3) -> Tuple[pd.Series, pd.Series]:
-        last_n_days = self.calendar.opens[:date].tail(trading_days)
-        data = DailySummary.objects.filter(date__in=last_n_days).values().order_by('stock', 'date')
-        snapshot = pd.DataFrame.from_records(data=data)
-
-        total_volume_key = 'investor_total_volume'
-        for idx, investor in enumerate(investors):
-            diff = snapshot[f'{investor}_buy_volume'] - snapshot[f'{investor}_sell_volume']
-            snapshot[total_volume_key] = diff if idx == 0 else snapshot[total_volume_key] + diff
-        snapshot['is_buy'] = snapshot[total_volume_key] > 0
-        aggregate_map = {total_volume_key: 'sum', 'is_buy': 'all'}
-        summary = snapshot[['stock_id', total_volume_key, 'is_buy']].groupby(snapshot['stock_id']).agg(aggregate_map)
-        ordered_summary = df.join(summary, on='id')
+        investors = tuple(investors)
+        return self.get_investor_continuous_buy_sweep(df, date, [investors], [trading_days])[(investors, trading_days)]
 
-        return ordered_summary['is_buy'] == True, ordered_summary[total_volume_key]
+    def get_rsi_filter(self, df: pd.DataFrame, date,
+                       min_value=0.0, max_value=100.0, batched=True) -> Tuple[pd.Series, pd.Series]:
+        if batched:
+            duration = self.get_date_open_duration(date)
+            snapshot = self.get_batched_rsi(duration['open'], duration['close'])
+            summary = df.join(snapshot, on='id')
+            return (summary['rsi'] >= min_value) & (summary['rsi'] <= max_value), summary['rsi']
 
-    def get_rsi_filter(self, df: pd.DataFrame, date, min_value=0.0, max_value=100.0) -> Tuple[pd.Series, pd.Series]:
         stocks = Stock.objects.filter(daily_summaries__date=date)
         snapshot = pd.DataFrame(columns=['stock_id', 'rsi'])
         for stock in stocks:
@@ -285,12 +463,30 @@ class TwseAnalyzer(Analyzer):
 
         return (summary['rsi'] >= min_value) & (summary['rsi'] <= max_value), summary['rsi']
 
-    def get_macd_signal_filter(self, df: pd.DataFrame, date) -> Tuple[pd.Series, pd.Series]:
+    def get_batched_rsi(self, from_ts, to_ts) -> pd.Series:
+        panel = self.get_closing_price_panel(from_ts, to_ts)
+        rsi = indicators.rsi(panel.to_numpy(dtype=float), period=14)
+        date_only_from_ts = from_ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        rsi = pd.DataFrame(rsi, index=panel.index, columns=panel.columns)[date_only_from_ts:to_ts]
+        if rsi.empty:
+            logger.warning('All stocks are skipped in get_rsi_filter')
+            return pd.Series(dtype=float, name='rsi')
+
+        curr_rsi = rsi.iloc[0]
+        logger.debug('%d stocks are skipped in get_rsi_filter', curr_rsi.isna().sum())
+        return curr_rsi.dropna().rename('rsi').rename_axis('stock_id')
+
+    def get_macd_signal_filter(self, df: pd.DataFrame, date, batched=True) -> Tuple[pd.Series, pd.Series]:
+        timezone = self.timezone
+        open_date = self.calendar_index.previous_close(date).tz_convert(timezone)
+        close_date = self.get_date_open_duration(date)['close']
+        if batched:
+            snapshot = self.get_batched_macd_signal(open_date, close_date)
+            summary = df.join(snapshot, on='id')
+            return summary['signal'] == True, summary['signal']
+
         stocks = Stock.objects.filter(daily_summaries__date=date)
         snapshot = pd.DataFrame(columns=['stock_id', 'signal'])
-        timezone = self.exchange.brokerage.TIMEZONE
-        open_date = self.calendar.previous_close(date).tz_convert(timezone)
-        close_date = self.get_date_open_duration(date)['close']
         for stock in stocks:
             kbars = self.get_technical_indicator_filled_kbars(stock, open_date, close_date, interval='1D').reset_index()
             len_kbars = len(kbars)
@@ -302,3 +498,18 @@ class TwseAnalyzer(Analyzer):
         summary = df.join(snapshot.set_index('stock_id'), on='id')
 
         return summary['signal'] == True, summary['signal']
+
+    def get_batched_macd_signal(self, from_ts, to_ts) -> pd.Series:
+        panel = self.get_closing_price_panel(from_ts, to_ts)
+        _, _, macd_hist = indicators.macd(panel.to_numpy(dtype=float))
+        date_only_from_ts = from_ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        hist = pd.DataFrame(macd_hist, index=panel.index, columns=panel.columns)[date_only_from_ts:to_ts]
+        if len(hist) < 2:
+            logger.warning('All stocks are skipped in get_macd_filter')
+            return pd.Series(dtype=object, name='signal')
+
+        prev_hist, curr_hist = hist.iloc[0], hist.iloc[1]
+        is_valid = prev_hist.notna() & curr_hist.notna()
+        logger.debug('%d stocks are skipped in get_macd_filter', np.count_nonzero(~is_valid))
+        signal = (prev_hist < 0) & (curr_hist > 0)
+        return signal[is_valid].rename('signal').rename_axis('stock_id')
@@ -1,38 +1,128 @@
 import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from uuid import uuid4
 import subprocess
+from typing import Tuple
 
+import django
+import numpy as np
 import pandas as pd
+from django.db import connections
 
 from stocks.helpers import operator as operators
-from stocks.models import BackTestRecord, Stock
+from stocks.helpers.checkpoint import Checkpoint
+from stocks.helpers.portfolio import Portfolio, PortfolioReplay
+from stocks.helpers.registry import BackTestRunRegistry
+from stocks.models import BackTestRecord, JobCheckpoint, Stock
 
 logger = logging.getLogger(__name__)
 
 
+class BackTestRecordSink:
+    # Trades are buffered in preallocated arrays and inserted by chunked `bulk_create` when the buffer fills or
+    # `flush` is called. Flushed trades are kept as the record table of the back test.
+    BATCH_SIZE = 1000
+
+    def __init__(self, commit, capacity=10000):
+        self._commit = commit
+        self._capacity = capacity
+        self._ts = np.empty(capacity, dtype=object)
+        self._stock_ids = np.empty(capacity, dtype=object)
+        self._run_ids = np.empty(capacity, dtype=object)
+        self._prices = np.empty(capacity, dtype=np.float64)
+        self._volumes = np.empty(capacity, dtype=np.int64)
+        self._size = 0
+        self._flushed_records = []
+
+    @property
+    def records(self) -> pd.DataFrame:
+        columns = ['ts', 'stock', 'price', 'volume']
+        records = pd.concat(self._flushed_records) if self._flushed_records else pd.DataFrame(columns=columns)
+        return records[columns].set_index(['ts', 'stock'])
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ts, stock_id, price, volume, run_id=None):
+        self._ts[self._size] = ts
+        self._stock_ids[self._size] = stock_id
+        self._run_ids[self._size] = run_id
+        self._prices[self._size] = price
+        self._volumes[self._size] = volume
+        self._size += 1
+        if self._size == self._capacity:
+            self.flush()
+
+    def flush(self):
+        if self._size == 0:
+            return
+        size = self._size
+        records = pd.DataFrame({
+            'ts': self._ts[:size].copy(),
+            'stock': self._stock_ids[:size].copy(),
+            'price': self._prices[:size].copy(),
+            'volume': self._volumes[:size].copy(),
+            'run': self._run_ids[:size].copy(),
+        })
+        BackTestRecord.objects.bulk_create(
+            [BackTestRecord(id=uuid4(), commit=self._commit, run_id=run_id, stock_id=stock_id, price=price,
+                            volume=volume, ts=ts)
+             for ts, stock_id, run_id, price, volume in zip(self._ts[:size], self._stock_ids[:size],
+                                                            self._run_ids[:size], self._prices[:size].tolist(),
+                                                            self._volumes[:size].tolist())],
+            batch_size=self.BATCH_SIZE)
+        self._flushed_records.append(records)
+        self._ts[:size] = None
+        self._stock_ids[:size] = None
+        self._run_ids[:size] = None
+        self._size = 0
+        logger.debug(f'{size} back test records flushed')
+
+    def discard(self, run_id):
+        # flushed records of a run are dropped from the record table, e.g. once the run failed
+        self._flushed_records = [records[records['run'] != run_id] for records in self._flushed_records]
+
+
 class BackTest:
 
     def __init__(self, operator):
         run_git_rev_parse = subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True)
         self.__operator = operator
         self.__commit = run_git_rev_parse.stdout.decode('utf-8').strip()
-        self.__records = \
-            pd.DataFrame(columns=['ts', 'stock', 'price', 'volume']).set_index(
-                ['ts', 'stock'])
+        self.__record_sink = BackTestRecordSink(self.__commit)
+        self._collected_records = None
+        self._run = None
 
     @property
     def operator(self):
         return self.__operator
 
+    @property
+    def commit(self):
+        return self.__commit
+
+    @property
+    def records(self) -> pd.DataFrame:
+        return self.__record_sink.records
+
+    def flush_records(self):
+        self.__record_sink.flush()
+
+    def discard_records(self, run_id):
+        self.__record_sink.discard(run_id)
+
     def insert_record(self, **kwargs):
+        if self._collected_records is not None:
+            self._collected_records.append({key: value for key, value in kwargs.items() if key != 'stock'})
+            return
         volume = kwargs['volume']
         stock = kwargs['stock']
         ts = kwargs['ts']
         price = kwargs['price']
         action = 'Buy' if volume > 0 else 'Sell'
         logger.info(f'[{ts}] {action} {int(abs(volume))} {stock.code} at {price}')
-        BackTestRecord.objects.create(id=uuid4(), commit=self.__commit, **kwargs)
-        self.__records.append({**kwargs, 'stock': stock.id}, ignore_index=True)
+        self.__record_sink.add(ts, stock.id, price, volume, run_id=self._run.id if self._run is not None else None)
 
     def start(self, from_ts, to_ts):
         stocks = self.pick_stocks(from_ts)
@@ -45,8 +135,8 @@ class BackTest:
             stock = Stock.objects.get(id=stock_row['id'])
             self.setup(stock, from_ts, to_ts)
             ticks = self.load_ticks(stock, from_ts, to_ts)
-            for _, tick_row in ticks.iterrows():
-                self.react(stock, tick_row)
+            self.replay(stock, ticks)
+            self.flush_records()
 
     def pick_stocks(self, from_ts) -> pd.DataFrame:
         pass
@@ -54,6 +144,10 @@ class BackTest:
     def load_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
         pass
 
+    def replay(self, stock, ticks: pd.DataFrame):
+        for _, tick_row in ticks.iterrows():
+            self.react(stock, tick_row)
+
     def react(self, stock, tick_row):
         pass
 
@@ -63,17 +157,152 @@ class BackTest:
 
 class TwseDayTradeBackTest(BackTest):
 
-    def __init__(self):
+    def __init__(self, vectorized=True, rerun=False, retry_failed=False):
         super(TwseDayTradeBackTest, self).__init__(operators.DayTradeTwseOperator())
         self._kbars = {}
         self._position = 0
+        self._vectorized = vectorized
+        self._rerun = rerun
+        self._retry_failed = retry_failed
+        self._registry = BackTestRunRegistry(self.commit, type(self).__name__, self.get_parameters())
+        self._checkpoint = Checkpoint(self._registry.job)
 
-    def start(self, from_date, to_date):
-        for date in pd.date_range(from_date, to_date, freq='D'):
-            logger.info('{} day trade back test'.format(date.strftime('%Y/%m/%d')))
-            from_ts = date.replace(hour=9, minute=00, second=0, microsecond=0)
-            to_ts = date.replace(hour=14, minute=30, second=0, microsecond=0)
-            super().start(from_ts, to_ts)
+    def get_parameters(self) -> dict:
+        analyzer = self.operator.analyzer
+        return {'min_rsi': analyzer.MIN_RSI, 'max_rsi': analyzer.MAX_RSI}
+
+    def get_completed_runs(self, sessions) -> dict:
+        return {} if self._rerun else self._registry.get_completed_runs(sessions)
+
+    def get_failed_units(self) -> set:
+        return self._checkpoint.get_units(JobCheckpoint.FAILED) if self._retry_failed else None
+
+    def skip_session(self, session, completed_runs, failed_units=None) -> bool:
+        run = completed_runs.get(self._registry.get_day(session))
+        if run is None:
+            if failed_units is None or session.strftime('%Y%m%d') in failed_units:
+                return False
+            logger.info('{} day trade back test skipped, not failed before'.format(session.strftime('%Y/%m/%d')))
+            return True
+        logger.info('{} day trade back test skipped, already run on this commit'.format(session.strftime('%Y/%m/%d')))
+        self._position = run.position
+        return True
+
+    def complete_session(self, session):
+        self._registry.complete(self._run, self._position)
+        self._checkpoint.complete(session.strftime('%Y%m%d'))
+        self._run = None
+
+    def fail_session(self, session):
+        # records of a failed day are dropped, and the next day starts without a position
+        logger.exception('{} day trade back test failed'.format(session.strftime('%Y/%m/%d')))
+        self._checkpoint.fail(session.strftime('%Y%m%d'), traceback.format_exc())
+        self.flush_records()
+        self._run.records.all().delete()
+        self.discard_records(self._run.id)
+        self._position = 0
+        self._run = None
+
+    @staticmethod
+    def get_session_range(session):
+        date = session.tz_localize(None)
+        from_ts = date.replace(hour=9, minute=00, second=0, microsecond=0)
+        to_ts = date.replace(hour=14, minute=30, second=0, microsecond=0)
+        return from_ts, to_ts
+
+    def start(self, from_date, to_date, workers=1):
+        if workers > 1:
+            return self.start_parallel(from_date, to_date, workers)
+        sessions = self.operator.analyzer.calendar_index.get_sessions(from_date, to_date)
+        completed_runs = self.get_completed_runs(sessions)
+        failed_units = self.get_failed_units()
+        for session in sessions:
+            if self.skip_session(session, completed_runs, failed_units):
+                continue
+            logger.info('{} day trade back test'.format(session.strftime('%Y/%m/%d')))
+            self._run = self._registry.begin(session)
+            try:
+                self.start_session(*self.get_session_range(session))
+            except Exception:  # pylint: disable=broad-except
+                self.fail_session(session)
+            else:
+                self.complete_session(session)
+
+    def start_session(self, from_ts, to_ts):
+        super().start(from_ts, to_ts)
+
+    def start_parallel(self, from_date, to_date, workers):
+        # Stocks are picked and stock-days are replayed by a process pool, then the records are inserted in the
+        # order of a serial run. Workers start every stock-day without a position, so a stock-day inheriting an
+        # open position from the previous one is replayed again here.
+        sessions = self.operator.analyzer.calendar_index.get_sessions(from_date, to_date)
+        completed_runs = self.get_completed_runs(sessions)
+        failed_units = self.get_failed_units()
+        pending_sessions = [session for session in sessions
+                            if self._registry.get_day(session) not in completed_runs
+                            and (failed_units is None or session.strftime('%Y%m%d') in failed_units)]
+        session_ranges = [self.get_session_range(session) for session in pending_sessions]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_back_test_worker,
+                                 initargs=(self._vectorized,)) as executor:
+            pick_futures = [executor.submit(pick_back_test_stocks, from_ts) for from_ts, _ in session_ranges]
+
+            # a session failing to be picked or prepared keeps its error, and fails in order like a failed replay
+            session_stock_days = {}
+            for session, (from_ts, to_ts), pick_future in zip(pending_sessions, session_ranges, pick_futures):
+                logger.info('{} day trade back test'.format(from_ts.strftime('%Y/%m/%d')))
+                try:
+                    stock_ids = pick_future.result()
+                    stocks = Stock.objects.in_bulk(stock_ids)
+                    if not stock_ids:
+                        logger.info('No stock picked')
+                    else:
+                        logger.info('Stock {} picked'.format([stocks[stock_id].code for stock_id in stock_ids]))
+                    session_stock_days[session] = [
+                        (stocks[stock_id], from_ts, to_ts,
+                         executor.submit(replay_back_test_stock_day, (stock_id, from_ts, to_ts)))
+                        for stock_id in stock_ids if self.prepare(stocks[stock_id], from_ts, to_ts)]
+                except Exception as ex:  # pylint: disable=broad-except
+                    session_stock_days[session] = ex
+
+            for session in sessions:
+                if self.skip_session(session, completed_runs, failed_units):
+                    continue
+                self._run = self._registry.begin(session)
+                try:
+                    stock_days = session_stock_days[session]
+                    if isinstance(stock_days, Exception):
+                        raise stock_days
+                    for stock, from_ts, to_ts, future in stock_days:
+                        records, position = future.result()
+                        if self._position != 0:
+                            self.setup(stock, from_ts, to_ts)
+                            self.replay(stock, self.load_stored_ticks(stock, from_ts, to_ts))
+                        else:
+                            for record in records:
+                                self.insert_record(stock=stock, **record)
+                            self._position = position
+                        self.flush_records()
+                except Exception:  # pylint: disable=broad-except
+                    self.fail_session(session)
+                else:
+                    self.complete_session(session)
+
+    def prepare(self, stock, from_ts, to_ts) -> bool:
+        # store the ticks and kbars replaying a stock-day needs, so that workers only read the database
+        if not stock.ticks.filter(ts__gte=from_ts, ts__lte=to_ts).exists():
+            if self.load_ticks(stock, from_ts, to_ts).empty:
+                return False
+        self.operator.analyzer.get_materialized_kbars(stock, from_ts, to_ts)
+        return True
+
+    def replay_stock_day(self, stock, from_ts, to_ts):
+        self._position = 0
+        self._collected_records = []
+        self.setup(stock, from_ts, to_ts)
+        self.replay(stock, self.load_stored_ticks(stock, from_ts, to_ts))
+        records, self._collected_records = self._collected_records, None
+        return records, self._position
 
     def pick_stocks(self, from_ts) -> pd.DataFrame:
         return self.operator.get_candidates(from_ts)
@@ -81,6 +310,10 @@ class TwseDayTradeBackTest(BackTest):
     def load_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
         return self.operator.brokerage.get_ticks(stock, from_ts, to_ts)
 
+    def load_stored_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
+        exchange = self.operator.exchange
+        return exchange.get_stock_brokerage_class(exchange.code).load_stored_ticks(stock, from_ts, to_ts)
+
     def setup(self, stock, from_ts, to_ts):
         analyzer = self.operator.analyzer
         self._kbars[stock.id] = analyzer.get_technical_indicator_filled_kbars(stock, from_ts, to_ts)
@@ -111,3 +344,125 @@ class TwseDayTradeBackTest(BackTest):
             volume = -self._position
             self.insert_record(ts=ts, stock=stock, price=price, volume=volume)
             self._position += volume
+
+    def get_timing_signals(self, kbars: pd.DataFrame, ticks: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        # `react` looks at the kbars labeled up to each tick: align ticks to them once and compare arrays instead
+        analyzer = self.operator.analyzer
+        counts = kbars.index.searchsorted(ticks.index, side='right')
+        if kbars.empty:
+            return np.zeros(len(ticks), dtype=bool), np.zeros(len(ticks), dtype=bool)
+
+        rsi = kbars['rsi']
+        min_rsi = rsi.rolling(3, min_periods=1).min().to_numpy()
+        max_rsi = rsi.rolling(3, min_periods=1).max().to_numpy()
+        macd_hist = kbars['macd_hist'].to_numpy()
+        curr = np.clip(counts - 1, 0, None)
+        prev = np.clip(counts - 2, 0, None)
+        prev_macd, curr_macd = macd_hist[prev], macd_hist[curr]
+
+        has_prev = counts > 1
+        is_in_timing = has_prev & (min_rsi[curr] < analyzer.MIN_RSI) & (prev_macd < 0) & (curr_macd > 0)
+        is_out_timing = has_prev & (max_rsi[curr] > analyzer.MAX_RSI) & (curr_macd < 0) & (prev_macd > 0)
+        return is_in_timing, is_out_timing
+
+    def replay(self, stock, ticks: pd.DataFrame):
+        if not self._vectorized:
+            return super().replay(stock, ticks)
+
+        is_in_timing, is_out_timing = self.get_timing_signals(self._kbars[stock.id], ticks)
+        is_before_final_out = ticks.index < ticks.index.normalize() + pd.Timedelta(hours=13)
+        in_positions = np.flatnonzero(is_in_timing & is_before_final_out)
+        out_positions = np.flatnonzero(is_out_timing | ~is_before_final_out)
+        prices = ticks['close'].to_numpy(dtype=float)
+        volumes = ticks['volume'].to_numpy(dtype=float)
+
+        # only the ticks changing the position matter, so jump from one to the next
+        cursor = 0
+        while self._position >= 0:
+            positions = in_positions if self._position == 0 else out_positions
+            i = np.searchsorted(positions, cursor)
+            if i == len(positions):
+                break
+            position = positions[i]
+            volume = volumes[position] * 1000 if self._position == 0 else -self._position
+            self.insert_record(ts=ticks.index[position], stock=stock, price=prices[position], volume=volume)
+            self._position += volume
+            cursor = position + 1
+
+
+class TwsePortfolioDayTradeBackTest(TwseDayTradeBackTest):
+    # Day trades of all picked stocks share one portfolio: ticks of the session are replayed in timestamp order
+    # across stocks, entries are limited by cash and open positions, and what is still held is sold at the last tick.
+
+    def __init__(self, capital=1000000.0, max_positions=5, rerun=False, retry_failed=False):
+        self._capital = capital
+        self._max_positions = max_positions
+        super(TwsePortfolioDayTradeBackTest, self).__init__(rerun=rerun, retry_failed=retry_failed)
+        self._portfolio = Portfolio(capital, max_positions)
+
+    def get_parameters(self) -> dict:
+        return {**super().get_parameters(), 'capital': self._capital, 'max_positions': self._max_positions}
+
+    def start(self, from_date, to_date, workers=1):
+        if workers > 1:
+            logger.warning('Portfolio back tests replay sessions in order, workers are ignored')
+        return super().start(from_date, to_date)
+
+    def skip_session(self, session, completed_runs, failed_units=None) -> bool:
+        if not super().skip_session(session, completed_runs, failed_units):
+            return False
+        run = completed_runs.get(self._registry.get_day(session))
+        if run is not None:
+            self._portfolio.cash -= sum(price * volume for price, volume in run.records.values_list('price', 'volume'))
+        return True
+
+    def fail_session(self, session):
+        # trades of the failed day are undone before its records are dropped
+        self.flush_records()
+        self._portfolio.cash += sum(price * volume for price, volume in self._run.records.values_list('price', 'volume'))
+        self._portfolio.positions.clear()
+        super().fail_session(session)
+
+    def start_session(self, from_ts, to_ts):
+        stocks = self.pick_stocks(from_ts)
+        if stocks.empty:
+            logger.info('No stock picked')
+            return
+        logger.info('Stock {} picked'.format(stocks['code'].to_list()))
+
+        replay = PortfolioReplay(self._portfolio, self.insert_trade)
+        picked_stocks = Stock.objects.in_bulk(stocks['id'].to_list())
+        for stock in map(picked_stocks.get, stocks['id']):
+            self.setup(stock, from_ts, to_ts)
+            ticks = self.load_ticks(stock, from_ts, to_ts)
+            is_in_timing, is_out_timing = self.get_timing_signals(self._kbars[stock.id], ticks)
+            is_before_final_out = ticks.index < ticks.index.normalize() + pd.Timedelta(hours=13)
+            replay.add_stream(stock, ticks, is_in_timing & is_before_final_out, is_out_timing | ~is_before_final_out)
+        replay.run()
+        self.flush_records()
+        logger.info(f'{replay.merged_count} of {replay.tick_count} ticks replayed, cash {self._portfolio.cash:.0f}')
+
+    def insert_trade(self, stock, ts, price, volume):
+        self.insert_record(ts=ts, stock=stock, price=price, volume=volume)
+
+
+_worker_back_test = None
+
+
+def init_back_test_worker(vectorized):
+    global _worker_back_test
+    django.setup()
+    # a forked worker must not use (or close) the connections of its parent
+    for connection in connections.all():
+        connection.connection = None
+    _worker_back_test = TwseDayTradeBackTest(vectorized=vectorized)
+
+
+def pick_back_test_stocks(from_ts):
+    stocks = _worker_back_test.pick_stocks(from_ts)
+    return [] if stocks.empty else stocks['id'].to_list()
+
+
+def replay_back_test_stock_day(stock_day):
+    stock_id, from_ts, to_ts = stock_day
+    return _worker_back_test.replay_stock_day(Stock.objects.get(id=stock_id), from_ts, to_ts)
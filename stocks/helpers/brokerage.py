@@ -1,3 +1,4 @@
+from typing import Tuple
 from uuid import uuid4
 
 import pandas as pd
@@ -27,9 +28,16 @@ class Brokerage:
     def get_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
         pass
 
+    def get_ranged_ticks(self, stock, durations) -> pd.DataFrame:
+        pass
+
 
 class TwseBrokerage(Brokerage):
     TIMEZONE = 'Asia/Taipei'
+    TICK_KEYS = ('ts', 'close', 'volume', 'bid_price',
+                 'bid_volume', 'ask_price', 'ask_volume')
+    KBAR_INTERVAL = '1Min'
+    KBAR_KEYS = ('ts', 'open', 'close', 'high', 'low', 'volume')
 
     @classmethod
     def setup_adapter(cls, *args, **kwargs):
@@ -41,28 +49,90 @@ class TwseBrokerage(Brokerage):
     def get_stock_meta(self, code):
         return self._adapter.Contracts.Stocks[code]
 
-    def get_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
-        tick_keys = ('ts', 'close', 'volume', 'bid_price',
-                     'bid_volume', 'ask_price', 'ask_volume')
-
-        tick_qs = stock.ticks.filter(ts__gte=from_ts, ts__lte=to_ts)
-        if tick_qs.exists():
-            df = pd.DataFrame.from_records(data=tick_qs.values(*tick_keys).order_by('ts'))
-            df['ts'] = df['ts'].dt.tz_convert(self.TIMEZONE)
-        else:
-            tick_cls = stock.ticks.model
-            tick_raw = self._adapter.ticks(self.get_stock_meta(stock.code),
-                                           from_ts.strftime('%Y-%m-%d'))
-            df = pd.DataFrame({**tick_raw})
-            df['ts'] = pd.to_datetime(df['ts']).dt.tz_localize(self.TIMEZONE)
-            df = df[(df['ts'] >= from_ts) & (df['ts'] <= to_ts)]
-
-            def mapper(tick):
-                return tick_cls(id=uuid4(), stock=stock, **tick)
-
-            ticks = list(map(mapper, df.to_dict('records')))
-            chunk_size = 20000  # MySQL insertion failed: MySQL server has gone away
-            for i in range(0, len(ticks), chunk_size):
-                tick_cls.objects.bulk_create(ticks[i:i + chunk_size])
+    @classmethod
+    def load_stored_ticks(cls, stock, from_ts, to_ts) -> pd.DataFrame:
+        tick_qs = (stock.ticks
+                   .filter(ts__gte=from_ts, ts__lte=to_ts)
+                   .values(*cls.TICK_KEYS)
+                   .order_by('ts'))
+        df = pd.DataFrame.from_records(data=tick_qs, columns=cls.TICK_KEYS)
+        df['ts'] = pd.to_datetime(df['ts'], utc=True).dt.tz_convert(cls.TIMEZONE)
+        return df.set_index('ts')
 
+    @classmethod
+    def load_stored_kbars(cls, stock, from_ts, to_ts) -> pd.DataFrame:
+        kbar_qs = (stock.kbars
+                   .filter(interval=cls.KBAR_INTERVAL, ts__gte=from_ts, ts__lte=to_ts)
+                   .values(*cls.KBAR_KEYS)
+                   .order_by('ts'))
+        df = pd.DataFrame.from_records(data=kbar_qs, columns=cls.KBAR_KEYS)
+        df['ts'] = pd.to_datetime(df['ts'], utc=True).dt.tz_convert(cls.TIMEZONE)
         return df.set_index('ts')
+
+    @classmethod
+    def store_kbars(cls, kbar_cls, stock_id, ticks: pd.DataFrame) -> pd.DataFrame:
+        # the analyzer imports the models, which import this module
+        from stocks.helpers.analyzer import Analyzer
+
+        kbars = Analyzer.ticks_to_kbars(ticks, interval=cls.KBAR_INTERVAL)
+
+        def mapper(kbar):
+            return kbar_cls(id=uuid4(), stock_id=stock_id, interval=cls.KBAR_INTERVAL, **kbar)
+
+        # bars of a session may be materialized concurrently, and partially stored sessions are kept as they are
+        kbar_cls.objects.bulk_create(list(map(mapper, kbars.reset_index().to_dict('records'))),
+                                     batch_size=5000, ignore_conflicts=True)
+        return kbars
+
+    def fetch_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
+        tick_cls = stock.ticks.model
+        tick_raw = self._adapter.ticks(self.get_stock_meta(stock.code),
+                                       from_ts.strftime('%Y-%m-%d'))
+        df = pd.DataFrame({**tick_raw})
+        df['ts'] = pd.to_datetime(df['ts']).dt.tz_localize(self.TIMEZONE)
+        df = df[(df['ts'] >= from_ts) & (df['ts'] <= to_ts)]
+
+        def mapper(tick):
+            return tick_cls(id=uuid4(), stock=stock, **tick)
+
+        ticks = list(map(mapper, df.to_dict('records')))
+        chunk_size = 20000  # MySQL insertion failed: MySQL server has gone away
+        for i in range(0, len(ticks), chunk_size):
+            tick_cls.objects.bulk_create(ticks[i:i + chunk_size])
+
+        df = df.set_index('ts')
+        self.store_kbars(stock.kbars.model, stock.id, df)
+        return df
+
+    def get_ticks(self, stock, from_ts, to_ts) -> pd.DataFrame:
+        if stock.ticks.filter(ts__gte=from_ts, ts__lte=to_ts).exists():
+            return self.load_stored_ticks(stock, from_ts, to_ts)
+        return self.fetch_ticks(stock, from_ts, to_ts)
+
+    @classmethod
+    def load_stored_ranged_ticks(cls, stock, durations) -> Tuple[pd.DataFrame, list]:
+        # `durations` are the time-ordered open/close of trading sessions: stored ticks of all of them are loaded by
+        # one query, along with the sessions without any stored tick
+        if not durations:
+            return pd.DataFrame(columns=cls.TICK_KEYS).set_index('ts'), []
+        stored = cls.load_stored_ticks(stock, durations[0]['open'], durations[-1]['close'])
+        starts = stored.index.searchsorted(pd.DatetimeIndex([duration['open'] for duration in durations]), side='left')
+        ends = stored.index.searchsorted(pd.DatetimeIndex([duration['close'] for duration in durations]), side='right')
+
+        frames = [stored.iloc[start:end] for start, end in zip(starts, ends) if end > start]
+        missing_durations = [duration for duration, start, end in zip(durations, starts, ends) if end == start]
+        return (pd.concat(frames) if frames else stored.iloc[:0]), missing_durations
+
+    def fetch_ranged_ticks(self, stock, durations) -> pd.DataFrame:
+        # ticks and kbars of the fetched sessions are stored along
+        frames = [self.fetch_ticks(stock, duration['open'], duration['close']) for duration in durations]
+        if not frames:
+            return pd.DataFrame(columns=self.TICK_KEYS).set_index('ts')
+        return pd.concat(frames).sort_index(kind='mergesort')
+
+    def get_ranged_ticks(self, stock, durations) -> pd.DataFrame:
+        # only the sessions without any stored tick are fetched from the adapter
+        ticks, missing_durations = self.load_stored_ranged_ticks(stock, durations)
+        if not missing_durations:
+            return ticks
+        return pd.concat([ticks, self.fetch_ranged_ticks(stock, missing_durations)]).sort_index(kind='mergesort')
@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+import requests
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseNotCachedError(LookupError):
+    pass
+
+
+class ResponseCache:
+    # Raw crawler responses stored gzipped under the hash of their method and URL, query string included. Entries
+    # are immutable: only responses that can never change, e.g. reports of past dates, are meant to be stored.
+    HEADER_KEYS = ('Content-Type',)
+
+    def __init__(self, root=None):
+        self._root = root or settings.CRAWLER_CACHE_DIR
+
+    @staticmethod
+    def get_url(method, url, params=None) -> str:
+        return requests.Request(method.upper(), url, params=params).prepare().url
+
+    @staticmethod
+    def get_key(method, url) -> str:
+        return hashlib.sha256(f'{method.upper()} {url}'.encode('utf-8')).hexdigest()
+
+    def get_path(self, key) -> str:
+        return os.path.join(self._root, key[:2], f'{key}.gz')
+
+    def get(self, method, url, params=None) -> Optional[requests.Response]:
+        url = self.get_url(method, url, params)
+        path = self.get_path(self.get_key(method, url))
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rb') as f:
+            meta = json.loads(f.readline())
+            content = f.read()
+        response = requests.Response()
+        response.status_code = meta['status_code']
+        response.encoding = meta['encoding']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.url = url
+        response._content = content  # pylint: disable=protected-access
+        return response
+
+    def put(self, method, url, response: requests.Response, params=None):
+        url = self.get_url(method, url, params)
+        path = self.get_path(self.get_key(method, url))
+        meta = {
+            'url': url,
+            'status_code': response.status_code,
+            'encoding': response.encoding,
+            'headers': {key: response.headers[key] for key in self.HEADER_KEYS if key in response.headers},
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(f'{path}.tmp', 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            f.write(response.content)
+        os.replace(f'{path}.tmp', path)
+        logger.debug(f'{method.upper()} {url} cached')
@@ -0,0 +1,49 @@
+import logging
+from typing import Iterable, List, Set
+from uuid import uuid4
+
+from stocks.models import JobCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    # Units of a long running job (e.g. the dates of a range) that completed or failed, so that an interrupted run
+    # can resume with the remaining units and the failed ones can be retried alone.
+
+    def __init__(self, job):
+        self._job = job
+
+    @property
+    def job(self):
+        return self._job
+
+    def get_units(self, status) -> Set[str]:
+        return set(JobCheckpoint.objects.filter(job=self._job, status=status).values_list('unit', flat=True))
+
+    def get_pending_units(self, units: Iterable[str], resume=False, retry_failed=False) -> List[str]:
+        units = list(units)
+        if retry_failed:
+            failed_units = self.get_units(JobCheckpoint.FAILED)
+            pending_units = [unit for unit in units if unit in failed_units]
+        elif resume:
+            completed_units = self.get_units(JobCheckpoint.COMPLETED)
+            pending_units = [unit for unit in units if unit not in completed_units]
+        else:
+            return units
+        logger.info(f'{self._job}: {len(pending_units)} of {len(units)} units pending')
+        return pending_units
+
+    def save(self, unit, status, error=None):
+        checkpoint = JobCheckpoint.objects.filter(job=self._job, unit=unit).first()
+        if checkpoint is None:
+            checkpoint = JobCheckpoint(id=uuid4(), job=self._job, unit=unit)
+        checkpoint.status = status
+        checkpoint.error = error
+        checkpoint.save()
+
+    def complete(self, unit):
+        self.save(unit, JobCheckpoint.COMPLETED)
+
+    def fail(self, unit, error):
+        self.save(unit, JobCheckpoint.FAILED, error)
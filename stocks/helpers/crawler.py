@@ -1,11 +1,14 @@
 import datetime
-import time
 import logging
 from functools import reduce
 
+import lxml.html
 import requests
 import pandas as pd
-from retrying import retry
+from django.conf import settings
+
+from stocks.helpers.cache import ResponseCache, ResponseNotCachedError
+from stocks.helpers.scheduler import CrawlerScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +24,6 @@ class Crawler:
     )
     DEFAULT_TIMEOUT_BETWEEN_SUCCESSFUL_REQUESTS = 15
 
-    __previous_response = None
-
     def __init__(self, **kwargs):
         self._user_agent = kwargs.get('user_agent', self.DEFAULT_USER_AGENT)
         self._retry_count = kwargs.get('retry_count', self.DEFAULT_RETRY_COUNT)
@@ -31,6 +32,9 @@ class Crawler:
         self._timeout_between_successful_requests = \
             kwargs.get('timeout_between_successful_requests',
                        self.DEFAULT_TIMEOUT_BETWEEN_SUCCESSFUL_REQUESTS)
+        self._scheduler = kwargs.get('scheduler') or CrawlerScheduler.get_shared()
+        self._cache = kwargs['cache'] if 'cache' in kwargs else ResponseCache()
+        self._offline = kwargs.get('offline', settings.CRAWLER_OFFLINE)
 
     @property
     def user_agent(self):
@@ -48,38 +52,62 @@ class Crawler:
     def timeout_between_successful_requests(self):
         return self._timeout_between_successful_requests
 
-    @classmethod
-    def set_previous_response(cls, value):
-        cls.__previous_response = value
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def offline(self):
+        return self._offline
+
+    def request(self, url, method, immutable=None, **kwargs) -> requests.Response:
+        # requests to an endpoint are paced `timeout_between_successful_requests` apart, other endpoints run along.
+        # `immutable` tells whether a response can be cached forever, it is given the response to validate it.
+        params = kwargs.get('params')
+        if self._cache is not None:
+            response = self._cache.get(method, url, params=params)
+            if response is not None:
+                return response
+        if self._offline:
+            raise ResponseNotCachedError(f'{method.upper()} {ResponseCache.get_url(method, url, params)} not cached')
 
-    def request(self, *args, **kwargs) -> requests.Response:
         headers = {
             'User-Agent': self.user_agent,
-            **kwargs.get('headers', {})
+            **kwargs.pop('headers', {})
         }
-
-        @retry(stop_max_attempt_number=self.retry_count, wait_fixed=self.retry_timeout)
-        def wrapped_request():
-            return requests.request(*args, **kwargs, headers=headers)
-
-        if self.__previous_response:
-            logger.debug('timeout between successful requests: %d seconds...',
-                         self.timeout_between_successful_requests)
-            time.sleep(self.timeout_between_successful_requests)
-
-        response = wrapped_request()
-        self.set_previous_response(response)
+        response = self._scheduler.request(method, url, headers=headers,
+                                           interval=self.timeout_between_successful_requests,
+                                           retry_count=self.retry_count,
+                                           max_backoff=self.retry_timeout / 1000,
+                                           **kwargs)
+        if self._cache is not None and immutable is not None and response.ok and immutable(response):
+            self._cache.put(method, url, response, params=params)
         return response
 
 
 class ExchangeCrawler(Crawler):
 
     def get_daily_summary(self, date: datetime.date) -> pd.DataFrame:
+        return self.parse_daily_summary(date, self.fetch_daily_summary(date))
+
+    def fetch_daily_summary(self, date: datetime.date):
+        # raw reports, picklable so that they can be parsed in another process
+        pass
+
+    @classmethod
+    def parse_daily_summary(cls, date: datetime.date, raw_summary) -> pd.DataFrame:
+        pass
+
+    def load_stock_directory(self) -> dict:
         pass
 
 
 class TwseCrawler(ExchangeCrawler):
     ORIGIN = 'https://www.twse.com.tw'
+    ISIN_ORIGIN = 'https://isin.twse.com.tw'
+    TIMEZONE = 'Asia/Taipei'
+    NO_DATA_MARKERS = ('沒有符合條件的資料', 'no data', 'no matching data')
+    DAILY_QUOTES_HEADERS = ('Security Code', 'Trade Volume', 'Closing Price')
 
     @classmethod
     def get_parsing_offset(cls, date):
@@ -87,7 +115,35 @@ class TwseCrawler(ExchangeCrawler):
             return -2, 1
         return -1, 2
 
-    def get_daily_transaction_summary(self, date: datetime.datetime) -> pd.DataFrame:
+    @classmethod
+    def is_settled(cls, date) -> bool:
+        # reports of a date never change once the date is over
+        return pd.Timestamp(date).date() < pd.Timestamp.now(tz=cls.TIMEZONE).date()
+
+    @classmethod
+    def is_daily_quotes_table(cls, response) -> bool:
+        # error and notice pages may have tables too, only a page with the daily quotes is final
+        if '<table' not in response.text:
+            return False
+        html = lxml.html.fromstring(response.content)
+        for table in html.iter('table'):
+            cells = {cell.text_content().strip() for cell in table.iter('th', 'td')}
+            if all(header in cells for header in cls.DAILY_QUOTES_HEADERS):
+                return True
+        return False
+
+    @classmethod
+    def is_json(cls, response) -> bool:
+        # only a report or the "no data" answer of a closed day is final; a throttled request is answered by an
+        # html page, errors by other statuses
+        try:
+            data = response.json()
+        except ValueError:
+            return False
+        stat = data.get('stat') if isinstance(data, dict) else None
+        return stat == 'OK' or (isinstance(stat, str) and any(marker in stat.lower() for marker in cls.NO_DATA_MARKERS))
+
+    def fetch_daily_transaction_summary(self, date: datetime.datetime) -> str:
         path = '/en/exchangeReport/MI_INDEX'
         url = f'{self.ORIGIN}{path}'
         params = {
@@ -95,8 +151,12 @@ class TwseCrawler(ExchangeCrawler):
             'date': date.strftime('%Y%m%d'),
             'type': 'ALLBUT0999',
         }
-        response = self.request(url=url, method='get', params=params)
-        daily_quotes_table_index, target_columns_level = self.get_parsing_offset(date)
+        immutable = self.is_daily_quotes_table if self.is_settled(date) else None
+        return self.request(url=url, method='get', params=params, immutable=immutable).text
+
+    @classmethod
+    def parse_daily_transaction_summary(cls, date: datetime.datetime, text: str) -> pd.DataFrame:
+        daily_quotes_table_index, target_columns_level = cls.get_parsing_offset(date)
         rename_mapper = {
             'Security Code': 'code',
             'Trade Volume': 'trade_volume',
@@ -111,7 +171,7 @@ class TwseCrawler(ExchangeCrawler):
             'Last Best Ask Price': 'last_best_ask_price',
             'Last Best Ask Volume': 'last_best_ask_volume',
         }
-        df = pd.read_html(response.text)[daily_quotes_table_index]
+        df = pd.read_html(text)[daily_quotes_table_index]
         df.columns = df.columns.get_level_values(target_columns_level)
         df.drop(['Dir(+/-)', 'Change', 'Price-Earning ratio'],
                 inplace=True, axis='columns')
@@ -119,7 +179,10 @@ class TwseCrawler(ExchangeCrawler):
         df.set_index(['code'], inplace=True)
         return df.apply(pd.to_numeric, errors='coerce')
 
-    def get_daily_investor_summary(self, date: datetime.datetime) -> pd.DataFrame:
+    def get_daily_transaction_summary(self, date: datetime.datetime) -> pd.DataFrame:
+        return self.parse_daily_transaction_summary(date, self.fetch_daily_transaction_summary(date))
+
+    def fetch_daily_investor_summary(self, date: datetime.datetime) -> dict:
         path = '/en/fund/T86'
         url = f'{self.ORIGIN}{path}'
         params = {
@@ -127,6 +190,11 @@ class TwseCrawler(ExchangeCrawler):
             'date': date.strftime('%Y%m%d'),
             'selectType': 'ALLBUT0999',
         }
+        immutable = self.is_json if self.is_settled(date) else None
+        return self.request(url=url, method='get', params=params, immutable=immutable).json()
+
+    @staticmethod
+    def parse_daily_investor_summary(data: dict) -> pd.DataFrame:
         rename_mapper = {
             0: 'code',
             1: 'foreign_dealer_buy_volume',
@@ -138,16 +206,25 @@ class TwseCrawler(ExchangeCrawler):
             14: 'local_dealer_hedge_buy_volume',
             15: 'local_dealer_hedge_sell_volume',
         }
-        data = self.request(url=url, method='get', params=params).json()
         df = pd.DataFrame(data['data'], columns=list(range(len(data['fields']))))
         df = df[list(rename_mapper.keys())]
         df.rename(columns=rename_mapper, inplace=True)
         df.set_index(['code'], inplace=True)
         return df.replace(',', '', regex=True).apply(pd.to_numeric, errors='coerce')
 
-    def get_daily_summary(self, date: datetime.datetime) -> pd.DataFrame:
-        transaction_summary = self.get_daily_transaction_summary(date)
-        investor_summary = self.get_daily_investor_summary(date)
+    def get_daily_investor_summary(self, date: datetime.datetime) -> pd.DataFrame:
+        return self.parse_daily_investor_summary(self.fetch_daily_investor_summary(date))
+
+    def fetch_daily_summary(self, date: datetime.datetime) -> tuple:
+        investor_summary_future = self.scheduler.submit(self.fetch_daily_investor_summary, date)
+        transaction_summary = self.fetch_daily_transaction_summary(date)
+        return transaction_summary, investor_summary_future.result()
+
+    @classmethod
+    def parse_daily_summary(cls, date: datetime.datetime, raw_summary: tuple) -> pd.DataFrame:
+        transaction_text, investor_data = raw_summary
+        transaction_summary = cls.parse_daily_transaction_summary(date, transaction_text)
+        investor_summary = cls.parse_daily_investor_summary(investor_data)
         return pd.merge(transaction_summary, investor_summary, left_index=True, right_index=True)
 
     def load_stock_candidates_by_partial_code(self, partial_code) -> dict:
@@ -171,6 +248,24 @@ class TwseCrawler(ExchangeCrawler):
 
         return reduce(reducer, suggestions, {})
 
+    def load_stock_directory(self) -> dict:
+        # every listed security in one page, whose rows start with a `<code>\u3000<name>` cell
+        path = '/isin/C_public.jsp'
+        url = f'{self.ISIN_ORIGIN}{path}'
+        params = {
+            'strMode': '2',
+        }
+        response = self.request(url=url, method='get', params=params)
+        response.encoding = 'cp950'
+        html = lxml.html.fromstring(response.text)
+        directory = {}
+        for cell in html.xpath('//tr/td[1]'):
+            code_and_name = cell.text_content().strip().split('\u3000', 1)
+            if len(code_and_name) == 2:
+                code, name = code_and_name
+                directory[code.strip()] = name.strip()
+        return directory
+
     def get_stock_name(self, code) -> str:
         candidates = self.load_stock_candidates_by_partial_code(code)
         return candidates[code]
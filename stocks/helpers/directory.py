@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import time
+from typing import Iterable, Mapping
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StockDirectory:
+    # Names of every listed security of an exchange, fetched in bulk by its crawler and kept on disk for `ttl`
+    # seconds. A stale directory is still used when it cannot be fetched again, e.g. offline.
+
+    def __init__(self, exchange, root=None, ttl=None):
+        self._exchange = exchange
+        self._path = os.path.join(root or os.path.join(settings.CRAWLER_CACHE_DIR, 'directory'), f'{exchange.code}.json')
+        self._ttl = settings.STOCK_DIRECTORY_TTL if ttl is None else ttl
+        self._names = None
+        self._loaded_at = None
+
+    def is_fresh(self) -> bool:
+        return os.path.exists(self._path) and time.time() - os.stat(self._path).st_mtime < self._ttl
+
+    def read(self) -> Mapping[str, str]:
+        with open(self._path) as f:
+            return json.load(f)
+
+    def write(self, names: Mapping[str, str]):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(f'{self._path}.tmp', 'w') as f:
+            json.dump(names, f, ensure_ascii=False)
+        os.replace(f'{self._path}.tmp', self._path)
+
+    def load(self) -> Mapping[str, str]:
+        # a directory held by a long-lived exchange is loaded again once its `ttl` is over
+        if self._names is not None and time.monotonic() - self._loaded_at < self._ttl:
+            return self._names
+        if self.is_fresh():
+            names = self.read()
+        else:
+            try:
+                names = self._exchange.crawler.load_stock_directory()
+                self.write(names)
+                logger.info(f'{len(names)} securities of {self._exchange.code} loaded into the directory')
+            except Exception:  # pylint: disable=broad-except
+                if not os.path.exists(self._path):
+                    raise
+                logger.exception(f'Failed to load the directory of {self._exchange.code}, the stale one is used')
+                names = self.read()
+        self._names, self._loaded_at = names, time.monotonic()
+        return self._names
+
+    def get_names(self, codes: Iterable[str]) -> Mapping[str, str]:
+        # codes out of the directory, e.g. delisted ones, are looked up one by one
+        codes = list(codes)
+        directory = self.load()
+        names = {code: directory[code] for code in codes if code in directory}
+        for code in codes:
+            if code not in names:
+                logger.info(f'{code} not found in the directory of {self._exchange.code}')
+                names[code] = self._exchange.crawler.get_stock_name(code)
+        return names
@@ -0,0 +1,82 @@
+from typing import Tuple
+
+import numpy as np
+
+# All indicators work column-wise on a (bars x stocks) matrix. NaN cells are treated as missing bars:
+# they neither advance nor reset the state of their column, which matches running TA-Lib on a
+# per-stock series after `dropna()`.
+
+
+def ema(values: np.ndarray, period: int, skip=0) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape, np.nan)
+    alpha = 2.0 / (period + 1)
+    count = np.zeros(values.shape[1], dtype=int)
+    total = np.zeros(values.shape[1])
+    state = np.full(values.shape[1], np.nan)
+
+    for row, value in enumerate(values):
+        is_valid = ~np.isnan(value)
+        count += is_valid
+
+        # seeded by the SMA of the first `period` valid values after `skip` ones, like TA-Lib does
+        is_seeding = is_valid & (count > skip) & (count <= skip + period)
+        total[is_seeding] += value[is_seeding]
+        is_seeded = is_valid & (count == skip + period)
+        state[is_seeded] = total[is_seeded] / period
+
+        is_smoothing = is_valid & (count > skip + period)
+        state[is_smoothing] += alpha * (value[is_smoothing] - state[is_smoothing])
+
+        result[row, is_valid] = state[is_valid]
+
+    return result
+
+
+def macd(values: np.ndarray, fast_period=12, slow_period=26,
+         signal_period=9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # TA-Lib aligns both EMAs on the slow one, so the fast EMA skips the leading bars
+    fast = ema(values, fast_period, skip=slow_period - fast_period)
+    slow = ema(values, slow_period)
+    macd_line = fast - slow
+    signal = ema(macd_line, signal_period)
+    macd_line[np.isnan(signal)] = np.nan
+    return macd_line, signal, macd_line - signal
+
+
+def rsi(values: np.ndarray, period=14) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape, np.nan)
+    count = np.zeros(values.shape[1], dtype=int)
+    prev_value = np.full(values.shape[1], np.nan)
+    gain = np.zeros(values.shape[1])
+    loss = np.zeros(values.shape[1])
+
+    for row, value in enumerate(values):
+        is_valid = ~np.isnan(value)
+        count += is_valid
+        diff = np.where(is_valid, value - prev_value, 0.0)
+        up = np.where(diff > 0, diff, 0.0)
+        down = np.where(diff < 0, -diff, 0.0)
+
+        is_seeding = is_valid & (count > 1) & (count <= period + 1)
+        gain[is_seeding] += up[is_seeding]
+        loss[is_seeding] += down[is_seeding]
+        is_seeded = is_valid & (count == period + 1)
+        gain[is_seeded] /= period
+        loss[is_seeded] /= period
+
+        # Wilder smoothing
+        is_smoothing = is_valid & (count > period + 1)
+        gain[is_smoothing] = (gain[is_smoothing] * (period - 1) + up[is_smoothing]) / period
+        loss[is_smoothing] = (loss[is_smoothing] * (period - 1) + down[is_smoothing]) / period
+
+        is_ready = is_valid & (count > period)
+        gain_loss = gain + loss
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value_rsi = np.where(gain_loss > 0, 100.0 * gain / gain_loss, 0.0)
+        result[row, is_ready] = value_rsi[is_ready]
+
+        prev_value[is_valid] = value[is_valid]
+
+    return result
@@ -0,0 +1,122 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from django.db import models
+
+from stocks.models import DailySummary, Stock
+
+logger = logging.getLogger(__name__)
+
+
+class InvestorStreak:
+    INVESTORS = ('foreign_dealer', 'investment_trust', 'local_dealer_proprietary', 'local_dealer_hedge')
+
+    @staticmethod
+    def get_net_volume_key(investor):
+        return f'{investor}_net_volume'
+
+    @staticmethod
+    def get_buy_streak_key(investor):
+        return f'{investor}_buy_streak'
+
+    @classmethod
+    def get_keys(cls):
+        return [key for investor in cls.INVESTORS
+                for key in (cls.get_net_volume_key(investor), cls.get_buy_streak_key(investor))]
+
+    @classmethod
+    def get_volume_keys(cls):
+        return [key for investor in cls.INVESTORS
+                for key in (f'{investor}_buy_volume', f'{investor}_sell_volume')]
+
+    @classmethod
+    def get_streaks(cls, summary_df: pd.DataFrame, prev_streak_df: pd.DataFrame) -> pd.DataFrame:
+        # both frames share the same index (stock id or code); stocks without a row on a session, e.g. suspended
+        # ones, carry their streaks over it, so a stock missing from `prev_streak_df` starts a new streak
+        streak_df = pd.DataFrame(index=summary_df.index)
+        for investor in cls.INVESTORS:
+            net_volume = summary_df[f'{investor}_buy_volume'] - summary_df[f'{investor}_sell_volume']
+            streak_key = cls.get_buy_streak_key(investor)
+            prev_streak = (prev_streak_df[streak_key].reindex(summary_df.index).fillna(0)
+                           if streak_key in prev_streak_df.columns else 0)
+            streak_df[cls.get_net_volume_key(investor)] = net_volume
+            streak_df[streak_key] = np.where(net_volume > 0, prev_streak + 1, 0).astype(int)
+        return streak_df
+
+    @classmethod
+    def load_streaks(cls, exchange, date, key='stock_id') -> pd.DataFrame:
+        # streaks as of `date`: stocks without a row on it carry the ones of their latest row before it
+        summary_qs = (DailySummary.objects
+                      .filter(stock__exchange=exchange, date=date)
+                      .values(key, *cls.get_keys()))
+        streak_df = pd.DataFrame.from_records(data=summary_qs, columns=[key, *cls.get_keys()]).set_index(key)
+
+        missing_stock_ids = list(Stock.objects
+                                 .filter(exchange=exchange)
+                                 .exclude(daily_summaries__date=date)
+                                 .values_list('id', flat=True))
+        last_dates = dict(DailySummary.objects
+                          .filter(stock_id__in=missing_stock_ids, date__lt=date)
+                          .values('stock_id')
+                          .annotate(last_date=models.Max('date'))
+                          .values_list('stock_id', 'last_date'))
+        if not last_dates:
+            return streak_df
+        fields = list(dict.fromkeys(['stock_id', 'date', key, *cls.get_keys()]))
+        carried_qs = (DailySummary.objects
+                      .filter(stock_id__in=list(last_dates), date__in=set(last_dates.values()))
+                      .values(*fields))
+        carried_df = pd.DataFrame.from_records(data=carried_qs, columns=fields)
+        carried_df = carried_df[carried_df['date'] == carried_df['stock_id'].map(last_dates)]
+        return pd.concat([streak_df, carried_df.set_index(key)[cls.get_keys()]])
+
+    @classmethod
+    def fill_net_volumes(cls, exchange) -> int:
+        # net volumes of summaries stored without them, in one statement
+        is_unfilled = models.Q()
+        for investor in cls.INVESTORS:
+            is_unfilled |= models.Q(**{f'{cls.get_net_volume_key(investor)}__isnull': True})
+        return (DailySummary.objects
+                .filter(is_unfilled, stock__exchange=exchange)
+                .update(**{cls.get_net_volume_key(investor):
+                           models.F(f'{investor}_buy_volume') - models.F(f'{investor}_sell_volume')
+                           for investor in cls.INVESTORS}))
+
+    @classmethod
+    def update_streaks(cls, exchange, from_date, to_date=None, panel=None) -> None:
+        # Streaks depend on the previous session, so they are recomputed forward from `from_date`. Once `to_date`
+        # is passed, the cascade stops as soon as every changed stock has been seen again unchanged.
+        calendar_index = exchange.calendar_index
+        sessions = calendar_index.get_sessions(from_date, pd.Timestamp.now(tz='UTC'))
+        if len(sessions) == 0:
+            return
+        keys = cls.get_keys()
+        prev_streak_df = cls.load_streaks(exchange, calendar_index.shift(sessions[0], -1))
+        unsettled_stock_ids = set()
+
+        for session in sessions:
+            summary_qs = (DailySummary.objects
+                          .filter(stock__exchange=exchange, date=session)
+                          .values('id', 'stock_id', *cls.get_volume_keys(), *keys))
+            summary_df = (pd.DataFrame
+                          .from_records(data=summary_qs, columns=['id', 'stock_id', *cls.get_volume_keys(), *keys])
+                          .set_index('stock_id'))
+            streak_df = cls.get_streaks(summary_df, prev_streak_df)
+
+            stored_df = summary_df[keys]
+            is_changed = ~((streak_df == stored_df) | (streak_df.isna() & stored_df.isna())).all(axis='columns')
+            changed_df = streak_df[is_changed].astype(object).where(streak_df[is_changed].notna(), None)
+            summaries = [DailySummary(id=summary_id, **streaks)
+                         for summary_id, streaks in zip(summary_df.loc[is_changed, 'id'],
+                                                        changed_df.to_dict('records'))]
+            DailySummary.objects.bulk_update(summaries, keys, batch_size=1000)
+            if panel is not None and panel.is_filled(session):
+                panel.write_frame(session, streak_df, replace=False)
+            logger.info('%s %s: %d investor streaks updated',
+                        exchange.code, session.strftime('%Y%m%d'), len(summaries))
+
+            prev_streak_df = pd.concat([streak_df, prev_streak_df[~prev_streak_df.index.isin(streak_df.index)]])
+            unsettled_stock_ids = (unsettled_stock_ids - set(summary_df.index)) | set(summary_df.index[is_changed])
+            if not unsettled_stock_ids and to_date is not None and session > to_date:
+                break
@@ -49,10 +49,10 @@ class ConservativeTwseOperator(TwseOperator):
         analyzer = self._analyzer
 
         pruned_date = pd.to_datetime(date.strftime('%Y/%m/%d'), utc=True)
-        if pruned_date not in analyzer.calendar.opens:
+        if not analyzer.calendar_index.is_open(pruned_date):
             return pd.DataFrame()
 
-        prev_trading_close = analyzer.calendar.previous_close(date)
+        prev_trading_close = analyzer.calendar_index.previous_close(date)
 
         df = analyzer.get_stocks()
 
@@ -83,10 +83,10 @@ class DayTradeTwseOperator(TwseOperator):
         analyzer = self._analyzer
 
         pruned_date = pd.to_datetime(date.strftime('%Y/%m/%d'), utc=True)
-        if pruned_date not in analyzer.calendar.opens:
+        if not analyzer.calendar_index.is_open(pruned_date):
             return pd.DataFrame()
 
-        prev_trading_close = analyzer.calendar.previous_close(date)
+        prev_trading_close = analyzer.calendar_index.previous_close(date)
 
         df = analyzer.get_stocks()
 
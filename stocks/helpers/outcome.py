@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from stocks.helpers.panel import SummaryPanel
+from stocks.models import DailySummary
+
+
+class OutcomeLabels:
+    # Forward-looking outcomes of every (date x stock) cell of the daily highest, lowest and closing price matrices.
+    # Windows start on the labeled date itself and span `horizon` trading days (rows) or calendar days after it;
+    # windows cut by the end of the data are computed on what is available, returns needing a later close are NaN.
+    FIELDS = ('highest_price', 'lowest_price', 'closing_price')
+    TRADING_DAYS = 'trading'
+    CALENDAR_DAYS = 'calendar'
+
+    def __init__(self, highs: pd.DataFrame, lows: pd.DataFrame, closes: pd.DataFrame):
+        self._highs = highs
+        self._lows = lows
+        self._closes = closes
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return self._closes.index
+
+    @property
+    def stock_ids(self) -> pd.Index:
+        return self._closes.columns
+
+    @classmethod
+    def load(cls, exchange, from_date, to_date, horizon, unit=CALENDAR_DAYS, panel=None):
+        # price matrices from `from_date` up to the end of the horizon of `to_date`
+        calendar_index = exchange.calendar_index
+        if unit == cls.TRADING_DAYS:
+            last_date = calendar_index.shift(to_date, horizon)
+            if pd.isna(last_date):
+                last_date = calendar_index.sessions[-1]
+        else:
+            last_date = to_date + pd.DateOffset(days=horizon)
+
+        panel_frames = panel.read_filled_range(cls.FIELDS, from_date, last_date) if panel is not None else None
+        if panel_frames is not None:
+            frames = [panel_frames[field] for field in cls.FIELDS]
+        else:
+            summary_qs = (DailySummary.objects
+                          .filter(stock__exchange=exchange, date__gte=from_date, date__lte=last_date)
+                          .values_list('date', 'stock_id', *cls.FIELDS))
+            summaries = pd.DataFrame.from_records(data=summary_qs, columns=['date', 'stock_id', *cls.FIELDS])
+            summaries['date'] = pd.to_datetime(summaries['date'])
+            from_day, last_day = SummaryPanel.to_days([from_date, last_date])
+            sessions = pd.DatetimeIndex(SummaryPanel.to_days(calendar_index.get_sessions(from_day, last_day)),
+                                        name='date')
+            frames = [summaries.pivot(index='date', columns='stock_id', values=field).astype(float).reindex(sessions)
+                      for field in cls.FIELDS]
+        return cls(*frames)
+
+    def get_window_ends(self, horizon, unit) -> np.ndarray:
+        # exclusive end row of the window starting on each date
+        if unit == self.TRADING_DAYS:
+            return np.minimum(np.arange(len(self.dates)) + horizon + 1, len(self.dates))
+        return self.dates.searchsorted(self.dates + pd.DateOffset(days=horizon), side='right')
+
+    def rolling_forward(self, frame: pd.DataFrame, horizon, unit, reducer) -> pd.DataFrame:
+        # a window of trading days is a fixed number of rows, and so is a window of calendar days on a daily grid
+        if unit == self.TRADING_DAYS or len(self.dates) == 0:
+            days = self.dates
+        else:
+            days = pd.date_range(self.dates[0], self.dates[-1], freq='D')
+        values = frame.reindex(days).to_numpy(dtype=float)
+        rolling = pd.DataFrame(values[::-1]).rolling(horizon + 1, min_periods=1)
+        rolled = getattr(rolling, reducer)().to_numpy()[::-1]
+        return pd.DataFrame(rolled[days.get_indexer(self.dates)], index=frame.index, columns=frame.columns)
+
+    def get_forward_max_high(self, horizon, unit=CALENDAR_DAYS) -> pd.DataFrame:
+        return self.rolling_forward(self._highs, horizon, unit, 'max')
+
+    def get_forward_min_low(self, horizon, unit=CALENDAR_DAYS) -> pd.DataFrame:
+        return self.rolling_forward(self._lows, horizon, unit, 'min')
+
+    def get_forward_return(self, horizon, unit=CALENDAR_DAYS) -> pd.DataFrame:
+        # close-to-close return to the last session of the window
+        closes = self._closes.to_numpy(dtype=float)
+        last_rows = self.get_window_ends(horizon, unit) - 1
+        if unit == self.TRADING_DAYS:
+            is_complete = np.arange(len(self.dates)) + horizon < len(self.dates)
+        else:
+            is_complete = np.asarray(self.dates + pd.DateOffset(days=horizon) <= self.dates.max())
+        returns = closes[last_rows] / closes - 1
+        returns[~is_complete] = np.nan
+        return pd.DataFrame(returns, index=self._closes.index, columns=self._closes.columns)
+
+    def score(self, labels: pd.DataFrame, dates, stock_ids) -> np.ndarray:
+        # label of each (date, stock id) pair; pairs out of the matrices are NaN
+        rows = labels.index.get_indexer(pd.DatetimeIndex(SummaryPanel.to_days(dates)))
+        columns = labels.columns.get_indexer(pd.Index(stock_ids, dtype=object))
+        values = np.pad(labels.to_numpy(dtype=float), ((0, 1), (0, 1)), constant_values=np.nan)
+        return values[rows, columns]
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+from typing import Mapping, Optional, Sequence
+from uuid import UUID
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from stocks.models import DailySummary
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryPanelError(LookupError):
+    pass
+
+
+class SummaryPanel:
+    # One memory-mapped (trading day x stock) float64 array per DailySummary field. Rows are ordinals of the
+    # sessions stored in the index file and columns are dense stock indices, so reading a date range is a
+    # zero-copy slice of the mapped file.
+    INDEX_FILE_NAME = 'index.json'
+    STOCK_CAPACITY_STEP = 256
+    FIELDS = tuple(field.attname for field in DailySummary._meta.concrete_fields
+                   if field.name not in ('id', 'date', 'stock'))
+
+    def __init__(self, exchange, root=None):
+        self._exchange = exchange
+        self._directory = os.path.join(root or settings.SUMMARY_PANEL_DIR, exchange.code)
+        self._index_mtime = None
+        self._sessions = np.array([], dtype='datetime64[D]')
+        self._filled = np.array([], dtype=bool)
+        self._stock_ids = pd.Index([], dtype=object)
+        self._capacity = 0
+        self._arrays = {}
+
+    @property
+    def exchange(self):
+        return self._exchange
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def sessions(self) -> np.ndarray:
+        self.load_index()
+        return self._sessions
+
+    @property
+    def stock_ids(self) -> pd.Index:
+        self.load_index()
+        return self._stock_ids
+
+    @staticmethod
+    def to_days(dates) -> np.ndarray:
+        # DateField lookups take the UTC date of aware datetimes, so do the same here
+        if not isinstance(dates, (list, tuple, np.ndarray, pd.Index, pd.Series)):
+            dates = [dates]
+        return pd.to_datetime(pd.Index(dates), utc=True).tz_localize(None).values.astype('datetime64[D]')
+
+    def get_path(self, name):
+        return os.path.join(self._directory, name)
+
+    def load_index(self):
+        path = self.get_path(self.INDEX_FILE_NAME)
+        if not os.path.exists(path):
+            return
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == self._index_mtime:
+            return
+
+        with open(path) as f:
+            index = json.load(f)
+        self._sessions = np.array(index['sessions'], dtype='datetime64[D]')
+        self._filled = np.isin(self._sessions, np.array(index['filled'], dtype='datetime64[D]'))
+        self._stock_ids = pd.Index([UUID(stock_id) for stock_id in index['stock_ids']], dtype=object)
+        self._capacity = index['capacity']
+        self._arrays = {}
+        self._index_mtime = mtime
+
+    def save_index(self):
+        index = {
+            'sessions': [str(session) for session in self._sessions],
+            'filled': [str(session) for session in self._sessions[self._filled]],
+            'stock_ids': [str(stock_id) for stock_id in self._stock_ids],
+            'capacity': self._capacity,
+        }
+        path = self.get_path(self.INDEX_FILE_NAME)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(f'{path}.tmp', path)
+        self._index_mtime = os.stat(path).st_mtime_ns
+
+    def get_array(self, field, writable=False):
+        key = (field, writable)
+        if key not in self._arrays:
+            path = self.get_path(f'{field}.npy')
+            shape = (len(self._sessions), self._capacity)
+            if os.path.exists(path):
+                array = np.load(path, mmap_mode='r+' if writable else 'r')
+            elif writable:
+                array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape)
+                array[:] = np.nan
+            else:
+                # sessions were filled before the field was added, its values are only in the database
+                raise SummaryPanelError(f'{field} is missing from the summary panel of {self.exchange.code}')
+            # a reader may see an array grown by a writer since the index was loaded, or one of a field not
+            # written since the panel grew; `read_block` handles both
+            if writable and array.shape != shape:
+                array = self.resize_array(path, array, shape)
+            self._arrays[key] = array
+        return self._arrays[key]
+
+    @staticmethod
+    def resize_array(path, array, shape):
+        resized = np.lib.format.open_memmap(f'{path}.tmp', mode='w+', dtype=np.float64, shape=shape)
+        resized[:] = np.nan
+        rows, columns = min(array.shape[0], shape[0]), min(array.shape[1], shape[1])
+        resized[:rows, :columns] = array[:rows, :columns]
+        resized.flush()
+        del resized, array
+        os.replace(f'{path}.tmp', path)
+        return np.load(path, mmap_mode='r+')
+
+    def get_ordinals(self, dates) -> np.ndarray:
+        days = self.to_days(dates)
+        sessions = self.sessions
+        ordinals = np.searchsorted(sessions, days)
+        is_session = ordinals < len(sessions)
+        is_session[is_session] = sessions[ordinals[is_session]] == days[is_session]
+        return np.where(is_session, ordinals, -1)
+
+    def get_range_ordinals(self, from_date, to_date):
+        sessions = self.sessions
+        from_ordinal = np.searchsorted(sessions, self.to_days(from_date)[0], side='left')
+        to_ordinal = np.searchsorted(sessions, self.to_days(to_date)[0], side='right')
+        return from_ordinal, to_ordinal
+
+    def is_filled(self, dates) -> bool:
+        ordinals = self.get_ordinals(dates)
+        return bool(len(ordinals) > 0 and np.all(ordinals >= 0) and np.all(self._filled[ordinals]))
+
+    def is_range_filled(self, from_date, to_date) -> bool:
+        sessions = self.sessions
+        from_day, to_day = self.to_days(from_date)[0], self.to_days(to_date)[0]
+        if len(sessions) == 0 or from_day < sessions[0] or to_day > sessions[-1]:
+            return False
+        from_ordinal, to_ordinal = self.get_range_ordinals(from_date, to_date)
+        return bool(from_ordinal < to_ordinal and np.all(self._filled[from_ordinal:to_ordinal]))
+
+    @staticmethod
+    def read_block(array, from_ordinal, to_ordinal, column_count) -> np.ndarray:
+        # an array only grows when its field is written, so cells out of it were never written
+        block = array[from_ordinal:to_ordinal, :column_count]
+        shape = (to_ordinal - from_ordinal, column_count)
+        if block.shape == shape:
+            return block
+        padded = np.full(shape, np.nan)
+        padded[:block.shape[0], :block.shape[1]] = block
+        return padded
+
+    def read_range(self, field, from_date, to_date) -> pd.DataFrame:
+        from_ordinal, to_ordinal = self.get_range_ordinals(from_date, to_date)
+        index = pd.DatetimeIndex(self._sessions[from_ordinal:to_ordinal], name='date')
+        columns = self._stock_ids.rename('stock_id')
+        values = self.read_block(self.get_array(field), from_ordinal, to_ordinal, len(columns))
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def get_snapshot(self, date, fields: Sequence[str]) -> pd.DataFrame:
+        ordinal = self.get_ordinals(date)[0]
+        columns = {field: self.read_block(self.get_array(field), ordinal, ordinal + 1, len(self._stock_ids))[0]
+                   for field in fields}
+        return pd.DataFrame(columns, index=self._stock_ids.rename('stock_id'))
+
+    def read_filled_range(self, fields: Sequence[str], from_date, to_date) -> Optional[Mapping[str, pd.DataFrame]]:
+        # None unless every field of the range can be read, so that callers fall back to the database
+        if not self.is_range_filled(from_date, to_date):
+            return None
+        try:
+            return {field: self.read_range(field, from_date, to_date) for field in fields}
+        except SummaryPanelError:
+            logger.warning('Summary panel of %s not readable, fall back to the database', self.exchange.code,
+                           exc_info=True)
+            return None
+
+    def read_filled_snapshot(self, date, fields: Sequence[str]) -> Optional[pd.DataFrame]:
+        if not self.is_filled(date):
+            return None
+        try:
+            return self.get_snapshot(date, fields)
+        except SummaryPanelError:
+            logger.warning('Summary panel of %s not readable, fall back to the database', self.exchange.code,
+                           exc_info=True)
+            return None
+
+    def extend_sessions(self, day):
+        calendar_sessions = self.exchange.calendar_index.sessions.tz_localize(None).values.astype('datetime64[D]')
+        if len(self._sessions) == 0:
+            self._sessions = calendar_sessions
+        elif day > self._sessions[-1]:
+            self._sessions = np.concatenate([self._sessions, calendar_sessions[calendar_sessions > self._sessions[-1]]])
+        else:
+            return
+        self._filled = np.concatenate([self._filled, np.zeros(len(self._sessions) - len(self._filled), dtype=bool)])
+
+    def write(self, date, stock_ids: Sequence[UUID], values: Mapping[str, np.ndarray], replace=True) -> None:
+        # without `replace`, only the given fields of the given stocks are overwritten
+        os.makedirs(self._directory, exist_ok=True)
+        self.load_index()
+
+        day = self.to_days(date)[0]
+        self.extend_sessions(day)
+        ordinal = self.get_ordinals(day)[0]
+        if ordinal < 0:
+            raise ValueError(f'{day} is not a session of the summary panel')
+
+        new_stock_ids = pd.Index(stock_ids, dtype=object).difference(self._stock_ids, sort=False)
+        self._stock_ids = self._stock_ids.append(new_stock_ids)
+        if len(self._stock_ids) > self._capacity:
+            step = self.STOCK_CAPACITY_STEP
+            self._capacity = (len(self._stock_ids) + step - 1) // step * step
+
+        positions = self._stock_ids.get_indexer(stock_ids)
+        for field in self.FIELDS:
+            if not replace and field not in values:
+                continue
+            array = self.get_array(field, writable=True)
+            if replace:
+                array[ordinal, :] = np.nan
+            if field in values:
+                array[ordinal, positions] = np.asarray(values[field], dtype=np.float64)
+            array.flush()
+
+        if replace:
+            self._filled[ordinal] = True
+        self.save_index()
+        self._arrays = {}
+        logger.debug('%s %s: %d stocks written to summary panel', self.exchange.code, day, len(positions))
+
+    def write_frame(self, date, frame: pd.DataFrame, replace=True) -> None:
+        # frame is indexed by stock id with DailySummary fields as columns
+        values = {field: frame[field].to_numpy(dtype=np.float64, na_value=np.nan)
+                  for field in self.FIELDS if field in frame.columns}
+        self.write(date, list(frame.index), values, replace=replace)
@@ -0,0 +1,114 @@
+import heapq
+import logging
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class Portfolio:
+    # Cash and open positions shared by every stock of a replay. Positions are bought in lots of 1000 shares.
+    LOT_SIZE = 1000
+
+    def __init__(self, capital, max_positions):
+        self.cash = float(capital)
+        self.max_positions = max_positions
+        self.positions = {}
+
+    def get_affordable_volume(self, price, volume):
+        if len(self.positions) >= self.max_positions or price <= 0:
+            return 0
+        lots = min(int(volume), int(self.cash // (price * self.LOT_SIZE)))
+        return max(lots, 0) * self.LOT_SIZE
+
+    def buy(self, stock_key, price, volume):
+        self.cash -= price * volume
+        self.positions[stock_key] = self.positions.get(stock_key, 0) + volume
+
+    def sell(self, stock_key, price):
+        volume = self.positions.pop(stock_key)
+        self.cash += price * volume
+        return volume
+
+
+class TickStream:
+    # the actionable ticks of a stock as arrays, plus its last tick for the end-of-day liquidation
+    def __init__(self, stock, ticks: pd.DataFrame, is_entry: np.ndarray, is_exit: np.ndarray):
+        positions = np.flatnonzero(is_entry | is_exit)
+        self.stock = stock
+        self.index = ticks.index[positions]
+        self.ts = self.to_nanos(self.index)
+        self.prices = ticks['close'].to_numpy(dtype=float)[positions]
+        self.volumes = ticks['volume'].to_numpy(dtype=float)[positions]
+        self.is_entry = np.asarray(is_entry)[positions]
+        self.is_exit = np.asarray(is_exit)[positions]
+        self.tick_count = len(ticks)
+        self.last_ts = ticks.index[-1] if len(ticks) else None
+        self.last_price = float(ticks['close'].iloc[-1]) if len(ticks) else None
+
+    @staticmethod
+    def to_nanos(index: pd.DatetimeIndex) -> np.ndarray:
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        return index.to_numpy().astype('datetime64[ns]').view(np.int64)
+
+    def __len__(self):
+        return len(self.ts)
+
+
+class PortfolioReplay:
+    # Tick streams of several stocks merged in timestamp order (ties in the order streams were added) by a heap of
+    # (ts, stream, cursor) entries, all driving one portfolio. Trades are reported to `on_trade(stock, ts, price,
+    # volume)` with positive volumes for buys and negative ones for sells.
+
+    def __init__(self, portfolio: Portfolio, on_trade: Callable):
+        self._portfolio = portfolio
+        self._on_trade = on_trade
+        self._streams = []
+
+    @property
+    def tick_count(self):
+        return sum(stream.tick_count for stream in self._streams)
+
+    @property
+    def merged_count(self):
+        # only the actionable ticks enter the heap
+        return sum(len(stream) for stream in self._streams)
+
+    def add_stream(self, stock, ticks: pd.DataFrame, is_entry, is_exit):
+        self._streams.append(TickStream(stock, ticks, is_entry, is_exit))
+
+    def run(self, liquidate=True):
+        portfolio = self._portfolio
+        streams = self._streams
+        heap = [(stream.ts[0], order, 0) for order, stream in enumerate(streams) if len(stream)]
+        heapq.heapify(heap)
+
+        while heap:
+            _, order, cursor = heap[0]
+            stream = streams[order]
+            if order in portfolio.positions:
+                if stream.is_exit[cursor]:
+                    price = stream.prices[cursor]
+                    volume = portfolio.sell(order, price)
+                    self._on_trade(stream.stock, stream.index[cursor], price, -volume)
+            elif stream.is_entry[cursor]:
+                price = stream.prices[cursor]
+                volume = portfolio.get_affordable_volume(price, stream.volumes[cursor])
+                if volume > 0:
+                    portfolio.buy(order, price, volume)
+                    self._on_trade(stream.stock, stream.index[cursor], price, volume)
+
+            cursor += 1
+            if cursor < len(stream):
+                heapq.heapreplace(heap, (stream.ts[cursor], order, cursor))
+            else:
+                heapq.heappop(heap)
+
+        if liquidate:
+            for order in sorted(portfolio.positions):
+                stream = streams[order]
+                volume = portfolio.sell(order, stream.last_price)
+                self._on_trade(stream.stock, stream.last_ts, stream.last_price, -volume)
@@ -0,0 +1,51 @@
+import json
+import logging
+from uuid import uuid4
+
+from stocks.helpers.panel import SummaryPanel
+from stocks.models import BackTestRun
+
+logger = logging.getLogger(__name__)
+
+
+class BackTestRunRegistry:
+    # Units of back test work keyed by (commit, strategy, parameters, date). A completed unit keeps the position
+    # the day ended with, so that a rerun can skip it and still carry the position into the next day.
+
+    def __init__(self, commit, strategy, parameters: dict):
+        self._commit = commit
+        self._strategy = strategy
+        self._parameters = json.dumps(parameters, sort_keys=True)
+
+    @property
+    def job(self):
+        return f'{self._strategy}:{self._commit}:{self._parameters}'
+
+    @staticmethod
+    def get_day(date):
+        return SummaryPanel.to_days(date)[0].item()
+
+    def get_run_qs(self):
+        return BackTestRun.objects.filter(commit=self._commit, strategy=self._strategy, parameters=self._parameters)
+
+    def get_completed_runs(self, dates) -> dict:
+        run_qs = self.get_run_qs().filter(date__in=[self.get_day(date) for date in dates], is_completed=True)
+        return {run.date: run for run in run_qs}
+
+    def begin(self, date) -> BackTestRun:
+        # records of an unfinished (or rerun) unit are dropped before it is run again
+        day = self.get_day(date)
+        run, _ = BackTestRun.objects.get_or_create(commit=self._commit, strategy=self._strategy,
+                                                   parameters=self._parameters, date=day,
+                                                   defaults={'id': uuid4()})
+        deleted_count, _ = run.records.all().delete()
+        if deleted_count:
+            logger.info(f'{deleted_count} records of the {day} run dropped')
+        run.is_completed = False
+        run.save()
+        return run
+
+    def complete(self, run: BackTestRun, position):
+        run.is_completed = True
+        run.position = position
+        run.save()
@@ -0,0 +1,131 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # `rate` requests per second with bursts of up to `capacity`. A token is reserved as soon as it is asked for,
+    # so concurrent callers are served in order instead of racing for the next refill.
+
+    def __init__(self, rate, capacity=1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def reserve(self) -> float:
+        # seconds to wait before the reserved token can be used
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def block(self, seconds):
+        # nobody gets a token in the next `seconds`, e.g. after the server asked to slow down
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class CrawlerScheduler:
+    # Requests share one pooled session and run at most `max_workers` at a time. Every endpoint (host and path) has
+    # its own token bucket, so different endpoints are fetched in parallel while each one keeps its own pace.
+    # Throttled (429), failing (5xx) and unreachable requests back off exponentially, honoring `Retry-After`.
+    DEFAULT_MAX_WORKERS = 4
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self._max_workers = max_workers
+        self._semaphore = threading.BoundedSemaphore(max_workers)
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._executor = None
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    @classmethod
+    def get_shared(cls):
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                cls.__shared = cls()
+            return cls.__shared
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
+
+    @staticmethod
+    def get_endpoint(url) -> str:
+        parts = urlsplit(url)
+        return f'{parts.netloc}{parts.path}'
+
+    def get_bucket(self, url, interval) -> TokenBucket:
+        # the bucket of an endpoint is set up by its first request
+        endpoint = self.get_endpoint(url)
+        with self._buckets_lock:
+            if endpoint not in self._buckets:
+                self._buckets[endpoint] = TokenBucket(1 / interval if interval > 0 else float('inf'))
+            return self._buckets[endpoint]
+
+    @staticmethod
+    def get_backoff(response, attempt, base, limit) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return min(limit, base * 2 ** attempt) * random.uniform(0.5, 1)
+
+    def request(self, method, url, interval=0, retry_count=3, backoff=1, max_backoff=60, **kwargs) \
+            -> requests.Response:
+        bucket = self.get_bucket(url, interval)
+        for attempt in range(retry_count):
+            is_last_attempt = attempt == retry_count - 1
+            bucket.acquire()
+            response = None
+            try:
+                with self._semaphore:
+                    response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                if is_last_attempt:
+                    raise
+                logger.warning(f'{method.upper()} {url} unreachable: {ex}')
+            else:
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    return response
+                if is_last_attempt:
+                    response.raise_for_status()
+                logger.warning(f'{method.upper()} {url} responded {response.status_code}')
+            wait = self.get_backoff(response, attempt, max(backoff, interval), max_backoff)
+            logger.info(f'back off {self.get_endpoint(url)} for {wait:.1f} seconds')
+            bucket.block(wait)
+        raise ValueError('retry_count should be positive')
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='crawler')
+        return self._executor.submit(fn, *args, **kwargs)
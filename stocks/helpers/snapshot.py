@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from django.conf import settings
+
+from stocks.helpers.panel import SummaryPanel
+from stocks.models import DailySummary
+
+logger = logging.getLogger(__name__)
+
+
+class SummarySnapshotCache:
+    # Full DailySummary cross-sections keyed by (exchange, date), evicted in LRU order once the
+    # cached frames exceed `max_bytes`. Shared by every analyzer of the process. Summaries are patched
+    # by other processes (re-dumps, streak updates, column backfills), so entries expire after `ttl`
+    # seconds.
+    FIELDS = SummaryPanel.FIELDS
+
+    def __init__(self, max_bytes, ttl):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._snapshots = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    @classmethod
+    def load_snapshot(cls, exchange, date) -> pd.DataFrame:
+        summary_qs = (DailySummary.objects
+                      .filter(stock__exchange=exchange, date=date)
+                      .values('stock_id', *cls.FIELDS))
+        snapshot = pd.DataFrame.from_records(data=summary_qs, columns=['stock_id', *cls.FIELDS])
+        return snapshot.set_index('stock_id')
+
+    def get(self, exchange, date) -> pd.DataFrame:
+        key = (exchange.code, SummaryPanel.to_days(date)[0])
+        with self._lock:
+            if key in self._snapshots:
+                snapshot, snapshot_bytes, loaded_at = self._snapshots[key]
+                if time.monotonic() - loaded_at < self._ttl:
+                    self._snapshots.move_to_end(key)
+                    return snapshot
+                del self._snapshots[key]
+                self._total_bytes -= snapshot_bytes
+
+        snapshot = self.load_snapshot(exchange, date)
+        if snapshot.empty:
+            # the date may not be dumped yet
+            return snapshot
+        snapshot_bytes = int(snapshot.memory_usage(deep=True).sum())
+        loaded_at = time.monotonic()
+
+        with self._lock:
+            if key not in self._snapshots:
+                self._snapshots[key] = (snapshot, snapshot_bytes, loaded_at)
+                self._total_bytes += snapshot_bytes
+            self._snapshots.move_to_end(key)
+            while self._total_bytes > self._max_bytes and len(self._snapshots) > 1:
+                evicted_key, (_, evicted_bytes, _) = self._snapshots.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+                logger.debug('Snapshot %s %s evicted', *evicted_key)
+            return self._snapshots[key][0]
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._total_bytes = 0
+
+
+snapshot_cache = SummarySnapshotCache(settings.SUMMARY_SNAPSHOT_CACHE_BYTES, settings.SUMMARY_SNAPSHOT_CACHE_TTL)
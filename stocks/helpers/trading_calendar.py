@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from trading_calendars import get_calendar
+
+
+class TradingCalendarIndex:
+    # Session labels, opens and closes of a trading calendar as sorted datetime64 (UTC) arrays, so that day
+    # offsets are `searchsorted` plus an ordinal offset instead of slicing the calendar from the start of history.
+    # A date maps to the ordinal of the last session labeled on or before it, like `calendar.opens[:date]` does.
+    __indices = {}
+
+    def __init__(self, calendar):
+        self._sessions = self.to_values(calendar.all_sessions)[0]
+        self._opens = self.to_values(calendar.opens.values)[0]
+        self._closes = self.to_values(calendar.closes.values)[0]
+        self._session_index = pd.DatetimeIndex(self._sessions).tz_localize('UTC')
+
+    @classmethod
+    def get(cls, calendar_code):
+        if calendar_code not in cls.__indices:
+            cls.__indices[calendar_code] = cls(get_calendar(calendar_code))
+        return cls.__indices[calendar_code]
+
+    @property
+    def sessions(self) -> pd.DatetimeIndex:
+        return self._session_index
+
+    @staticmethod
+    def to_values(dates):
+        is_scalar = np.ndim(dates) == 0
+        index = pd.to_datetime(pd.Index([dates] if is_scalar else dates), utc=True)
+        return index.tz_localize(None).values.astype('datetime64[ns]'), is_scalar
+
+    @staticmethod
+    def from_ordinals(values, ordinals, is_scalar):
+        ordinals = np.asarray(ordinals)
+        is_valid = (ordinals >= 0) & (ordinals < len(values))
+        result = np.where(is_valid, values[np.clip(ordinals, 0, len(values) - 1)], np.datetime64('NaT'))
+        result = pd.DatetimeIndex(result).tz_localize('UTC')
+        return result[0] if is_scalar else result
+
+    def floor_ordinals(self, values):
+        return np.searchsorted(self._sessions, values, side='right') - 1
+
+    def get_ordinals(self, dates):
+        values, is_scalar = self.to_values(dates)
+        ordinals = self.floor_ordinals(values)
+        return ordinals[0] if is_scalar else ordinals
+
+    def is_open(self, dates):
+        values, is_scalar = self.to_values(dates)
+        ordinals = np.searchsorted(self._sessions, values, side='left')
+        is_session = ordinals < len(self._sessions)
+        is_session[is_session] = self._sessions[ordinals[is_session]] == values[is_session]
+        return bool(is_session[0]) if is_scalar else is_session
+
+    def shift(self, dates, n):
+        # session labels n sessions after (or before, if negative) the sessions of `dates`
+        values, is_scalar = self.to_values(dates)
+        ordinals = self.floor_ordinals(values) + n
+        return self.from_ordinals(self._sessions, ordinals, is_scalar)
+
+    def window(self, date, n) -> pd.DatetimeIndex:
+        # the last n session labels up to the session of `date`
+        ordinal = self.get_ordinals(date)
+        return self.sessions[max(ordinal - n + 1, 0):ordinal + 1]
+
+    def get_sessions(self, from_date, to_date) -> pd.DatetimeIndex:
+        from_ordinal = np.searchsorted(self._sessions, self.to_values(from_date)[0][0], side='left')
+        to_ordinal = np.searchsorted(self._sessions, self.to_values(to_date)[0][0], side='right')
+        return self.sessions[from_ordinal:to_ordinal]
+
+    def get_opens(self, sessions):
+        values, is_scalar = self.to_values(sessions)
+        return self.from_ordinals(self._opens, self.floor_ordinals(values), is_scalar)
+
+    def get_closes(self, sessions):
+        values, is_scalar = self.to_values(sessions)
+        return self.from_ordinals(self._closes, self.floor_ordinals(values), is_scalar)
+
+    def previous_close(self, dates):
+        # the last close strictly before `dates`
+        values, is_scalar = self.to_values(dates)
+        ordinals = np.searchsorted(self._closes, values, side='left') - 1
+        return self.from_ordinals(self._closes, ordinals, is_scalar)
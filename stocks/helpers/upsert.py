@@ -0,0 +1,137 @@
+import logging
+import os
+import uuid
+from typing import Mapping, Sequence
+
+import numpy as np
+from django.db import connections, models, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BulkUpsert:
+    # Rows given as columns are inserted by chunked `executemany` calls, in one transaction. Rows colliding with
+    # `unique_fields` update every other given column instead (ON DUPLICATE KEY UPDATE on MySQL, ON CONFLICT ... DO
+    # UPDATE elsewhere), so that writing the same rows again is safe. Columns are converted to database values as a
+    # whole: numeric arrays with NaN as NULL, UUIDs as hex where the database has no UUID type, and scalars once.
+    BATCH_SIZE = 1000
+    NUMERIC_FIELD_TYPES = (models.FloatField, models.IntegerField, models.DecimalField)
+
+    def __init__(self, model, unique_fields: Sequence[str], using='default'):
+        self._model = model
+        self._unique_fields = unique_fields
+        self._using = using
+
+    @staticmethod
+    def get_uuids(count) -> list:
+        # random (version 4) UUIDs as hex, in one draw
+        random_bytes = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+        random_bytes[:, 6] = (random_bytes[:, 6] & 0x0f) | 0x40
+        random_bytes[:, 8] = (random_bytes[:, 8] & 0x3f) | 0x80
+        hexes = random_bytes.tobytes().hex()
+        return [hexes[start:start + 32] for start in range(0, 32 * count, 32)]
+
+    def get_field(self, field_name) -> models.Field:
+        return self._model._meta.get_field(field_name)  # pylint: disable=protected-access
+
+    def get_sql(self, field_names) -> str:
+        connection = connections[self._using]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._model._meta.db_table)  # pylint: disable=protected-access
+        columns = [quote_name(self.get_field(field_name).column) for field_name in field_names]
+        unique_columns = [quote_name(self.get_field(field_name).column) for field_name in self._unique_fields]
+        pk_column = quote_name(self._model._meta.pk.column)  # pylint: disable=protected-access
+        update_columns = [column for column in columns if column not in unique_columns and column != pk_column]
+
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+        if connection.vendor == 'mysql':
+            return f'{sql} ON DUPLICATE KEY UPDATE {", ".join(f"{column} = VALUES({column})" for column in update_columns)}'
+        return (f'{sql} ON CONFLICT ({", ".join(unique_columns)}) DO UPDATE SET '
+                f'{", ".join(f"{column} = excluded.{column}" for column in update_columns)}')
+
+    def prepare_column(self, field_name, values, row_count) -> list:
+        connection = connections[self._using]
+        field = self.get_field(field_name)
+        if np.ndim(values) == 0:
+            return [field.get_db_prep_save(values, connection)] * row_count
+
+        value_field = field.target_field if field.is_relation else field
+        if isinstance(value_field, self.NUMERIC_FIELD_TYPES) and isinstance(values, np.ndarray) \
+                and values.dtype.kind in 'iuf':
+            is_null = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(len(values), dtype=bool)
+            dtype = np.float64 if isinstance(value_field, models.FloatField) else np.int64
+            prepared = np.where(is_null, 0, values).astype(dtype).astype(object)
+            prepared[is_null] = None
+            return prepared.tolist()
+        if isinstance(value_field, models.UUIDField) and not connection.features.has_native_uuid_field:
+            return [value.hex if isinstance(value, uuid.UUID) else value for value in values]
+        return [field.get_db_prep_save(value, connection) for value in values]
+
+    def prepare(self, columns: Mapping[str, object]) -> list:
+        # columns are sequences of the same length, or scalars repeated on every row
+        row_count = max((len(values) for values in columns.values() if np.ndim(values) > 0), default=0)
+        return list(zip(*[self.prepare_column(field_name, values, row_count)
+                          for field_name, values in columns.items()]))
+
+    def insert(self, cursor, sql, rows):
+        for start in range(0, len(rows), self.BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + self.BATCH_SIZE])
+
+    def execute(self, columns: Mapping[str, object]) -> int:
+        rows = self.prepare(columns)
+        with transaction.atomic(using=self._using), connections[self._using].cursor() as cursor:
+            self.insert(cursor, self.get_sql(list(columns)), rows)
+        logger.debug(f'{len(rows)} {self._model.__name__} rows upserted')
+        return len(rows)
+
+
+class BulkStagedUpdate(BulkUpsert):
+    # Rows given as columns are staged into a temporary table by chunked `executemany` calls, then applied to the
+    # existing rows matching `unique_fields` by one set-based UPDATE ... JOIN, in one transaction. Staged rows
+    # without a match are ignored.
+
+    def get_staging_table(self) -> str:
+        return f'{self._model._meta.db_table}_staging'  # pylint: disable=protected-access
+
+    def get_staging_sqls(self, field_names) -> Sequence[str]:
+        connection = connections[self._using]
+        quote_name = connection.ops.quote_name
+        staging_table = quote_name(self.get_staging_table())
+        columns = [quote_name(self.get_field(field_name).column) for field_name in field_names]
+        column_definitions = [f'{column} {self.get_field(field_name).db_type(connection)}'
+                              for field_name, column in zip(field_names, columns)]
+        temporary = 'TEMPORARY ' if connection.vendor == 'mysql' else ''
+        return [
+            f'DROP {temporary}TABLE IF EXISTS {staging_table}',
+            f'CREATE TEMPORARY TABLE {staging_table} ({", ".join(column_definitions)})',
+            f'INSERT INTO {staging_table} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})',
+        ]
+
+    def get_update_sql(self, field_names) -> str:
+        connection = connections[self._using]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self._model._meta.db_table)  # pylint: disable=protected-access
+        staging_table = quote_name(self.get_staging_table())
+        unique_columns = [quote_name(self.get_field(field_name).column) for field_name in self._unique_fields]
+        update_columns = [quote_name(self.get_field(field_name).column) for field_name in field_names
+                          if field_name not in self._unique_fields]
+        conditions = ' AND '.join(f'{table}.{column} = {staging_table}.{column}' for column in unique_columns)
+        if connection.vendor == 'mysql':
+            assignments = ', '.join(f'{table}.{column} = {staging_table}.{column}' for column in update_columns)
+            return f'UPDATE {table} INNER JOIN {staging_table} ON {conditions} SET {assignments}'
+        assignments = ', '.join(f'{column} = {staging_table}.{column}' for column in update_columns)
+        return f'UPDATE {table} SET {assignments} FROM {staging_table} WHERE {conditions}'
+
+    def execute(self, columns: Mapping[str, object]) -> int:
+        field_names = list(columns)
+        rows = self.prepare(columns)
+        drop_sql, create_sql, insert_sql = self.get_staging_sqls(field_names)
+        with transaction.atomic(using=self._using), connections[self._using].cursor() as cursor:
+            cursor.execute(drop_sql)
+            cursor.execute(create_sql)
+            self.insert(cursor, insert_sql, rows)
+            cursor.execute(self.get_update_sql(field_names))
+            updated_count = cursor.rowcount
+            cursor.execute(drop_sql)
+        logger.debug(f'{updated_count} of {len(rows)} staged {self._model.__name__} rows updated')
+        return updated_count
@@ -0,0 +1,35 @@
+import logging
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from stocks.helpers.analytics import BackTestAnalytics
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    COMMIT_KEY = 'commit'
+    TRADES_KEY = 'trades'
+
+    help = 'Compare performance metrics of day trade back test commits'
+
+    def add_arguments(self, parser):
+        parser.add_argument(f'--{self.COMMIT_KEY}', required=True, nargs='+')
+        parser.add_argument(f'--{self.TRADES_KEY}', help='CSV file path to write the paired trades into')
+
+    def handle(self, *args, **options):
+        commits = options.get(self.COMMIT_KEY)
+        analytics = BackTestAnalytics.load(commits)
+        summary = analytics.summarize()
+        if summary.empty:
+            logger.info('No trade found')
+            return
+
+        with pd.option_context('display.max_columns', None, 'display.width', None):
+            self.stdout.write(summary.reindex(columns=[commit for commit in commits if commit in summary.columns])
+                              .to_string())
+        trades_path = options.get(self.TRADES_KEY)
+        if trades_path:
+            analytics.trades.to_csv(trades_path, index=False)
+            logger.info(f'{len(analytics.trades)} trades written to {trades_path}')
@@ -0,0 +1,114 @@
+import datetime
+import hashlib
+import logging
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stocks.helpers.checkpoint import Checkpoint
+from stocks.helpers.investor import InvestorStreak
+from stocks.helpers.panel import SummaryPanel
+from stocks.helpers.upsert import BulkStagedUpdate
+from stocks.models import Exchange, Stock, DailySummary
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    EXCHANGE_KEY = 'exchange'
+    COLUMNS_KEY = 'columns'
+    DATE_FORMAT = '%Y%m%d'
+    FROM_KEY = 'from'
+    TO_KEY = 'to'
+    RESUME_KEY = 'resume'
+    RETRY_FAILED_KEY = 'retry_failed'
+    COLUMN_CHOICES = [field.name for field in DailySummary._meta.concrete_fields  # pylint: disable=protected-access
+                      if field.name not in ('id', 'date', 'stock')]
+
+    help = 'Backfill columns of existing daily summaries of a exchange from the crawled reports'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__exchange = None
+        self.__panel = None
+        self.__checkpoint = None
+        self.__summary_update = BulkStagedUpdate(DailySummary, unique_fields=('stock', 'date'))
+
+    def add_arguments(self, parser):
+        exchange_choices = [
+            exchange.code for exchange in Exchange.objects.all()
+        ]
+        parser.add_argument(f'--{self.EXCHANGE_KEY}',
+                            required=True, choices=exchange_choices)
+        parser.add_argument(f'--{self.COLUMNS_KEY}', required=True, nargs='+', choices=self.COLUMN_CHOICES)
+        parser.add_argument(f'--{self.FROM_KEY}', required=True)
+        parser.add_argument(f'--{self.TO_KEY}', required=True)
+        parser.add_argument(f'--{self.RESUME_KEY}', action='store_true',
+                            help='skip the dates already backfilled by previous runs')
+        parser.add_argument('--retry-failed', dest=self.RETRY_FAILED_KEY, action='store_true',
+                            help='only backfill the dates failed in previous runs')
+
+    @classmethod
+    def parse_date(cls, value: str) -> datetime.date:
+        try:
+            return datetime.datetime.strptime(f'{value}Z', f'{cls.DATE_FORMAT}%z')
+        except Exception as ex:
+            raise CommandError('invalid date') from ex
+
+    def backfill_daily_summary(self, date: datetime.date, columns) -> int:
+        daily_exchange_summary_df = self.__exchange.get_daily_summary(date)
+        stock_ids = dict(Stock.objects
+                         .filter(exchange=self.__exchange, code__in=daily_exchange_summary_df.index.to_list())
+                         .values_list('code', 'id'))
+        # stocks never dumped have no summary to update
+        daily_exchange_summary_df = daily_exchange_summary_df[daily_exchange_summary_df.index.isin(list(stock_ids))]
+        summary_stock_ids = [stock_ids[code] for code in daily_exchange_summary_df.index]
+
+        updated_count = self.__summary_update.execute({
+            'stock': summary_stock_ids,
+            'date': date,
+            **{column: daily_exchange_summary_df[column].to_numpy() for column in columns},
+        })
+
+        if self.__panel.is_filled(date):
+            panel_df = daily_exchange_summary_df[columns].set_axis(summary_stock_ids, axis='index')
+            self.__panel.write_frame(date, panel_df, replace=False)
+        return updated_count
+
+    def handle(self, *args, **options):
+        exchange_code = options[self.EXCHANGE_KEY]
+        from_date = self.parse_date(options[self.FROM_KEY])
+        to_date = self.parse_date(options[self.TO_KEY])
+        columns = sorted(set(options[self.COLUMNS_KEY]))
+
+        self.__exchange = Exchange.objects.get(code=exchange_code)
+        self.__panel = SummaryPanel(self.__exchange)
+        # job names are bounded, whatever columns are given
+        columns_digest = hashlib.sha1(','.join(columns).encode('utf-8')).hexdigest()
+        self.__checkpoint = Checkpoint(f'backfill_summary_columns:{exchange_code}:{columns_digest}')
+
+        # net volumes and streaks are derived from the investor volumes, so they are recomputed afterward instead
+        streak_keys = InvestorStreak.get_keys()
+        crawled_columns = [column for column in columns if column not in streak_keys]
+        is_streak_affected = any(column in streak_keys or column in InvestorStreak.get_volume_keys()
+                                 for column in columns)
+
+        sessions = self.__exchange.calendar_index.get_sessions(from_date, to_date)
+        dates = {session.strftime(self.DATE_FORMAT): session for session in sessions}
+        pending_date_texts = self.__checkpoint.get_pending_units(list(dates),
+                                                                 resume=options.get(self.RESUME_KEY),
+                                                                 retry_failed=options.get(self.RETRY_FAILED_KEY))
+        for date_text in pending_date_texts:
+            if not crawled_columns:
+                self.__checkpoint.complete(date_text)
+                continue
+            try:
+                updated_count = self.backfill_daily_summary(dates[date_text], crawled_columns)
+                logger.info('%s %s: %d summaries backfilled', exchange_code, date_text, updated_count)
+                self.__checkpoint.complete(date_text)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('%s %s: failed', exchange_code, date_text)
+                self.__checkpoint.fail(date_text, traceback.format_exc())
+
+        if is_streak_affected:
+            InvestorStreak.update_streaks(self.__exchange, from_date, to_date, panel=self.__panel)
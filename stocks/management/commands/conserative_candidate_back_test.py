@@ -1,14 +1,16 @@
 import logging
 import math
+import traceback
 from uuid import uuid4
 
 import pandas as pd
 from django.core.management.base import BaseCommand
-from django.db import models
+from django.db import transaction
 
-from stocks.models import DailySummary
 from stocks.models.summary import ConservativeStrategyTestRecord
 from stocks.helpers import analyzer as analyzers
+from stocks.helpers.checkpoint import Checkpoint
+from stocks.helpers.outcome import OutcomeLabels
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +18,8 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     FROM_KEY = 'from'
     TO_KEY = 'to'
+    RESUME_KEY = 'resume'
+    RETRY_FAILED_KEY = 'retry_failed'
 
     help = 'Conservative candidates back test'
 
@@ -25,6 +29,10 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(f'--{self.FROM_KEY}', required=True)
         parser.add_argument(f'--{self.TO_KEY}', required=True)
+        parser.add_argument(f'--{self.RESUME_KEY}', action='store_true',
+                            help='skip the dates already tested by previous runs')
+        parser.add_argument('--retry-failed', dest=self.RETRY_FAILED_KEY, action='store_true',
+                            help='only test the dates failed in previous runs')
 
     def handle(self, *args, **options):
         testing_duration = {
@@ -32,42 +40,61 @@ class Command(BaseCommand):
             'to': pd.to_datetime(options.get(self.TO_KEY), utc=True),
         }
         analyzer = analyzers.TwseAnalyzer()
-        calendar = analyzer.calendar
+        calendar_index = analyzer.calendar_index
         investors_options = ('foreign_dealer', 'investment_trust', 'local_dealer_proprietary')
         df = analyzer.get_stocks()
-        for date in reversed(calendar.opens[testing_duration['from']:testing_duration['to']]):
+        sessions = calendar_index.get_sessions(testing_duration['from'], testing_duration['to'])
+        investors_combinations = [
+            [investor for investor_idx, investor in enumerate(investors_options)
+             if (investor_picker & (1 << investor_idx)) != 0]
+            for investor_picker in range(1, int(math.pow(2, len(investors_options))))
+        ]
+        trading_days_options = range(2, 10)
+        opens = calendar_index.get_opens(sessions)
+        if len(opens) == 0:
+            return
+        outcome_labels = OutcomeLabels.load(analyzer.exchange, opens[0], opens[-1], 30, panel=analyzer.panel)
+        highest_in_30_days = outcome_labels.get_forward_max_high(30)
+        checkpoint = Checkpoint('conserative_candidate_back_test')
+        pending_dates = set(checkpoint.get_pending_units([date.strftime('%Y%m%d') for date in opens],
+                                                         resume=options.get(self.RESUME_KEY),
+                                                         retry_failed=options.get(self.RETRY_FAILED_KEY)))
+        for date in reversed(opens):
+            date_text = date.strftime('%Y%m%d')
+            if date_text not in pending_dates:
+                continue
             try:
-                prev_trading_close = analyzer.calendar.previous_close(date)
-                last_date = date + pd.DateOffset(days=30)
+                prev_trading_close = calendar_index.previous_close(date)
                 macd_signal_filter, _ = analyzer.get_macd_signal_filter(df, prev_trading_close)
-                try:
-                    for trading_days in range(2, 10):
-                        for investor_picker in range(1, int(math.pow(2, len(investors_options)))):
-                            investors = []
-                            for investor_idx, investor in enumerate(investors_options):
-                                if (investor_picker & (1 << investor_idx)) != 0:
-                                    investors.append(investor)
-                            investor_continuous_buy_filter, _ = \
-                                analyzer.get_investor_continuous_buy_filter(df,
-                                                                            prev_trading_close,
-                                                                            investors=investors,
-                                                                            trading_days=trading_days)
-                            picked_stocks = df[macd_signal_filter & investor_continuous_buy_filter]
-                            for _, stock_row in picked_stocks.iterrows():
-                                stock_id = stock_row['id']
-                                highest_price = (DailySummary.objects
-                                                 .filter(stock_id=stock_id, date__gte=date, date__lte=last_date)
-                                                 .aggregate(models.Max('highest_price')))['highest_price__max']
-                                ConservativeStrategyTestRecord.objects.create(
-                                    id=uuid4(),
-                                    date=date,
-                                    stock_id=stock_id,
-                                    investors=','.join(investors),
-                                    continuous_days=trading_days,
-                                    highest_in_30_days=highest_price,
-                                )
-                except Exception:
-                    logger.exception(f'Exception occurred on {date.strftime("%Y%m%d")} after getting macd signal filter')
+                investor_sweep = analyzer.get_investor_continuous_buy_sweep(df, prev_trading_close,
+                                                                            investors_combinations,
+                                                                            trading_days_options)
+                picked_combinations = [
+                    (investors, trading_days,
+                     df.loc[macd_signal_filter & investor_sweep[(tuple(investors), trading_days)][0], 'id'])
+                    for trading_days in trading_days_options
+                    for investors in investors_combinations
+                ]
+                highest_prices = pd.Series(outcome_labels.score(highest_in_30_days, [date] * len(df), df['id']),
+                                           index=df['id'])
+                records = [
+                    ConservativeStrategyTestRecord(
+                        id=uuid4(),
+                        date=date,
+                        stock_id=stock_id,
+                        investors=','.join(investors),
+                        continuous_days=trading_days,
+                        highest_in_30_days=highest_prices[stock_id],
+                    )
+                    for investors, trading_days, stock_ids in picked_combinations
+                    for stock_id in stock_ids
+                    if not pd.isna(highest_prices[stock_id])
+                ]
+                # a date failing halfway leaves no records behind to be duplicated by its retry
+                with transaction.atomic():
+                    ConservativeStrategyTestRecord.objects.bulk_create(records, batch_size=1000)
+                checkpoint.complete(date_text)
+                logger.info(f'Success {date_text}')
             except Exception:
-                logger.exception(f'Exception occurred on {date.strftime("%Y%m%d")}')
-            logger.info(f'Success {date.strftime("%Y%m%d")}')
+                logger.exception(f'Exception occurred on {date_text}')
+                checkpoint.fail(date_text, traceback.format_exc())
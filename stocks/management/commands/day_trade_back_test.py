@@ -11,6 +11,13 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     FROM_KEY = 'from'
     TO_KEY = 'to'
+    ITERATIVE_KEY = 'iterative'
+    WORKERS_KEY = 'workers'
+    RERUN_KEY = 'rerun'
+    RETRY_FAILED_KEY = 'retry_failed'
+    PORTFOLIO_KEY = 'portfolio'
+    CAPITAL_KEY = 'capital'
+    MAX_POSITIONS_KEY = 'max_positions'
 
     help = 'Day trade back test'
 
@@ -20,10 +27,30 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(f'--{self.FROM_KEY}', required=True)
         parser.add_argument(f'--{self.TO_KEY}', required=True)
+        parser.add_argument(f'--{self.ITERATIVE_KEY}', action='store_true',
+                            help='replay ticks one by one, e.g. to verify the vectorized replay')
+        parser.add_argument(f'--{self.WORKERS_KEY}', type=int, default=1,
+                            help='number of processes picking stocks and replaying stock-days')
+        parser.add_argument(f'--{self.RERUN_KEY}', action='store_true',
+                            help='run again the days already back tested on the current commit')
+        parser.add_argument('--retry-failed', dest=self.RETRY_FAILED_KEY, action='store_true',
+                            help='only run the days failed in previous runs on the current commit')
+        parser.add_argument(f'--{self.PORTFOLIO_KEY}', action='store_true',
+                            help='replay the picked stocks of a day together on one portfolio')
+        parser.add_argument(f'--{self.CAPITAL_KEY}', type=float, default=1000000.0)
+        parser.add_argument('--max-positions', dest=self.MAX_POSITIONS_KEY, type=int, default=5)
 
     def handle(self, *args, **options):
         from_ts = pd.to_datetime(options.get(self.FROM_KEY))
         to_ts = pd.to_datetime(options.get(self.TO_KEY))
 
-        backtest = backtests.TwseDayTradeBackTest()
-        backtest.start(from_ts, to_ts)
+        if options.get(self.PORTFOLIO_KEY):
+            backtest = backtests.TwsePortfolioDayTradeBackTest(capital=options.get(self.CAPITAL_KEY),
+                                                               max_positions=options.get(self.MAX_POSITIONS_KEY),
+                                                               rerun=options.get(self.RERUN_KEY),
+                                                               retry_failed=options.get(self.RETRY_FAILED_KEY))
+        else:
+            backtest = backtests.TwseDayTradeBackTest(vectorized=not options.get(self.ITERATIVE_KEY),
+                                                      rerun=options.get(self.RERUN_KEY),
+                                                      retry_failed=options.get(self.RETRY_FAILED_KEY))
+        backtest.start(from_ts, to_ts, workers=options.get(self.WORKERS_KEY))
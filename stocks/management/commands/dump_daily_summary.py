@@ -1,15 +1,19 @@
 import datetime
 import logging
-from uuid import uuid4
-from typing import Sequence, Mapping, Set
-from functools import reduce
+import multiprocessing
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from uuid import UUID
+from typing import Sequence, Mapping
 
-from django.db import models
 from django.core.management.base import BaseCommand, CommandError
 
-import numpy as np
 import pandas as pd
 
+from stocks.helpers.checkpoint import Checkpoint
+from stocks.helpers.investor import InvestorStreak
+from stocks.helpers.panel import SummaryPanel
+from stocks.helpers.upsert import BulkUpsert
 from stocks.models import Exchange, Stock, DailySummary
 
 logger = logging.getLogger(__name__)
@@ -21,6 +25,9 @@ class Command(BaseCommand):
     DATE_KEY = 'date'
     FROM_KEY = 'from'
     TO_KEY = 'to'
+    WORKERS_KEY = 'workers'
+    RESUME_KEY = 'resume'
+    RETRY_FAILED_KEY = 'retry_failed'
     TIMEOUT = 15
 
     help = 'Dump daily summary of a exchange'
@@ -28,6 +35,9 @@ class Command(BaseCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.__exchange = None
+        self.__panel = None
+        self.__checkpoint = None
+        self.__summary_upsert = BulkUpsert(DailySummary, unique_fields=('stock', 'date'))
 
     def add_arguments(self, parser):
         exchange_choices = [
@@ -38,6 +48,12 @@ class Command(BaseCommand):
         parser.add_argument(f'--{self.DATE_KEY}')
         parser.add_argument(f'--{self.FROM_KEY}')
         parser.add_argument(f'--{self.TO_KEY}')
+        parser.add_argument(f'--{self.WORKERS_KEY}', type=int, default=1,
+                            help='number of days fetched and parsed at once when dumping a range')
+        parser.add_argument(f'--{self.RESUME_KEY}', action='store_true',
+                            help='skip the dates already dumped by previous runs')
+        parser.add_argument('--retry-failed', dest=self.RETRY_FAILED_KEY, action='store_true',
+                            help='only dump the dates failed in previous runs')
 
     @classmethod
     def parse_date(cls, value: str) -> datetime.date:
@@ -53,74 +69,93 @@ class Command(BaseCommand):
 
         missing_codes = set(stock_codes) - set(existing_stock_codes)
         if len(missing_codes) > 0:
+            names = self.__exchange.get_stock_names(missing_codes)
             missing_stocks = map(
-                lambda code: Stock.get_new_record(self.__exchange, code), missing_codes)
+                lambda code: Stock.get_new_record(self.__exchange, code, names[code]), missing_codes)
             Stock.objects.bulk_create(missing_stocks)
 
     @staticmethod
-    def get_stock_map(exchange: Exchange, stock_codes: Sequence[str]) -> Mapping[str, Stock]:
-        return reduce(
-            lambda acc, stock: {**acc, stock.code: stock},
-            Stock.objects.filter(exchange=exchange, code__in=stock_codes),
-            {}
-        )
-
-    @staticmethod
-    def get_summary_existing_codes(exchange: Exchange, date: datetime.date) -> Set[str]:
-        codes = (DailySummary.objects
-                 .filter(stock__exchange=exchange, date=date)
-                 .annotate(code=models.F('stock__code'))
-                 .values_list('code', flat=True))
-        return set(codes)
-
-    @staticmethod
-    def trans_summary_df_to_dict(exchange_summary_df: pd.DataFrame) -> dict:
-        exchange_summary_dict = exchange_summary_df.to_dict(orient='index')
-
-        def replace_nan_by_none(value):
-            return None if np.isnan(value) else value
-
-        def purify(stock_summary_dict):
-            return {
-                key: replace_nan_by_none(stock_summary_dict[key]) for key in stock_summary_dict
-            }
-
-        return {
-            code: purify(exchange_summary_dict[code]) for code in exchange_summary_dict
-        }
+    def get_stock_ids(exchange: Exchange, stock_codes: Sequence[str]) -> Mapping[str, UUID]:
+        return dict(Stock.objects
+                    .filter(exchange=exchange, code__in=stock_codes)
+                    .values_list('code', 'id'))
 
     def dump_daily_summary(self, exchange_code: str, date_text: str) -> None:
         logger.debug(
             '%s %s: start to dump daily summary', exchange_code, date_text)
         date = self.parse_date(date_text)
 
-        if date not in self.__exchange.calendar.opens:
+        if not self.__exchange.calendar_index.is_open(date):
             logger.info('%s %s: skipped', exchange_code, date_text)
+            self.__checkpoint.complete(date_text)
             return
 
         try:
             daily_exchange_summary_df = self.__exchange.get_daily_summary(date)
-            daily_exchange_summary = self.trans_summary_df_to_dict(daily_exchange_summary_df)
-            stock_codes = daily_exchange_summary.keys()
-            self.fill_missing_stock(stock_codes)
-            stock_map = self.get_stock_map(self.__exchange, stock_codes)
-            summary_existing_codes = self.get_summary_existing_codes(self.__exchange, date)
-
-            summaries = []
-            for code in set(stock_codes) - summary_existing_codes:
-                daily_stock_summary = daily_exchange_summary[code]
-                stock = stock_map[code]
-                summaries.append(DailySummary(
-                    id=uuid4(),
-                    date=date,
-                    stock=stock,
-                    **daily_stock_summary,
-                ))
-            DailySummary.objects.bulk_create(summaries)
-
+            self.write_daily_summary(date, daily_exchange_summary_df)
             logger.info('%s %s: success', exchange_code, date_text)
+            self.__checkpoint.complete(date_text)
         except Exception:  # pylint: disable=broad-except
             logger.exception('%s %s: failed', exchange_code, date_text)
+            self.__checkpoint.fail(date_text, traceback.format_exc())
+
+    def write_daily_summary(self, date: datetime.date, daily_exchange_summary_df: pd.DataFrame) -> None:
+        prev_session = self.__exchange.calendar_index.shift(date, -1)
+        prev_streak_df = InvestorStreak.load_streaks(self.__exchange, prev_session, key='stock__code')
+        daily_exchange_summary_df = daily_exchange_summary_df.join(
+            InvestorStreak.get_streaks(daily_exchange_summary_df, prev_streak_df))
+        stock_codes = daily_exchange_summary_df.index.to_list()
+        self.fill_missing_stock(stock_codes)
+        stock_ids = self.get_stock_ids(self.__exchange, stock_codes)
+        summary_stock_ids = [stock_ids[code] for code in stock_codes]
+
+        # rows already written for the date are updated, so that a day can be dumped again to patch it
+        self.__summary_upsert.execute({
+            'id': BulkUpsert.get_uuids(len(stock_codes)),
+            'date': date,
+            'stock': summary_stock_ids,
+            **{key: daily_exchange_summary_df[key].to_numpy() for key in daily_exchange_summary_df.columns},
+        })
+
+        panel_df = daily_exchange_summary_df.set_axis(summary_stock_ids, axis='index')
+        self.__panel.write_frame(date, panel_df)
+
+    def backfill_daily_summary(self, exchange_code: str, date_texts: Sequence[str], workers: int) -> None:
+        # Reports are fetched by `workers` threads at the pace of the crawler, parsed by as many processes and
+        # written by this thread, so that crawling, parsing and inserting overlap. At most `2 * workers` days are
+        # in flight.
+        crawler = self.__exchange.crawler
+        remaining_date_texts = iter(date_texts)
+        fetching, parsing = {}, {}
+        # parse processes start from a fork server, so that none inherits a lock held by a fetch thread
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('forkserver')) as parse_executor, \
+                ThreadPoolExecutor(max_workers=workers) as fetch_executor:
+            while True:
+                while len(fetching) + len(parsing) < 2 * workers:
+                    date_text = next(remaining_date_texts, None)
+                    if date_text is None:
+                        break
+                    fetching[fetch_executor.submit(crawler.fetch_daily_summary, self.parse_date(date_text))] = date_text
+                if not fetching and not parsing:
+                    break
+
+                done, _ = wait([*fetching, *parsing], return_when=FIRST_COMPLETED)
+                for future in done:
+                    is_fetched = future in fetching
+                    date_text = fetching.pop(future) if is_fetched else parsing.pop(future)
+                    date = self.parse_date(date_text)
+                    try:
+                        if is_fetched:
+                            parsing[parse_executor.submit(type(crawler).parse_daily_summary,
+                                                          date, future.result())] = date_text
+                            continue
+                        self.write_daily_summary(date, future.result())
+                        logger.info('%s %s: success', exchange_code, date_text)
+                        self.__checkpoint.complete(date_text)
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception('%s %s: failed', exchange_code, date_text)
+                        self.__checkpoint.fail(date_text, traceback.format_exc())
 
     def handle(self, *args, **options):
         exchange_code = options[self.EXCHANGE_KEY]
@@ -128,12 +163,35 @@ class Command(BaseCommand):
         to_date_text = options.get(self.TO_KEY)
 
         self.__exchange = Exchange.objects.get(code=exchange_code)
+        self.__panel = SummaryPanel(self.__exchange)
+        self.__checkpoint = Checkpoint(f'dump_daily_summary:{exchange_code}')
 
         if from_date_text and to_date_text:
-            for date in pd.date_range(from_date_text, to_date_text)[::-1]:
-                date_text = date.strftime(self.DATE_FORMAT)
-                self.dump_daily_summary(exchange_code, date_text)
+            date_texts = [date.strftime(self.DATE_FORMAT) for date in pd.date_range(from_date_text, to_date_text)]
+            pending_date_texts = self.__checkpoint.get_pending_units(date_texts[::-1],
+                                                                     resume=options.get(self.RESUME_KEY),
+                                                                     retry_failed=options.get(self.RETRY_FAILED_KEY))
+            workers = options.get(self.WORKERS_KEY)
+            if workers > 1:
+                # non-trading days are dropped up front instead of being skipped one by one
+                sessions = self.__exchange.calendar_index.get_sessions(self.parse_date(from_date_text),
+                                                                       self.parse_date(to_date_text))
+                session_texts = {session.strftime(self.DATE_FORMAT) for session in sessions}
+                self.backfill_daily_summary(exchange_code,
+                                            [date_text for date_text in pending_date_texts
+                                             if date_text in session_texts],
+                                            workers)
+            else:
+                for date_text in pending_date_texts:
+                    self.dump_daily_summary(exchange_code, date_text)
+            # days are dumped backward, so streaks have to be carried forward afterward
+            InvestorStreak.update_streaks(self.__exchange, self.parse_date(from_date_text),
+                                          self.parse_date(to_date_text), panel=self.__panel)
         else:
             default_date = datetime.date.today().strftime(self.DATE_FORMAT)
             date_text = options.get(self.DATE_KEY, default_date)
             self.dump_daily_summary(exchange_code, date_text)
+            date = self.parse_date(date_text)
+            # a patched past day changes the streaks carried by the sessions after it
+            if DailySummary.objects.filter(stock__exchange=self.__exchange, date__gt=date).exists():
+                InvestorStreak.update_streaks(self.__exchange, date, date, panel=self.__panel)
@@ -0,0 +1,53 @@
+import logging
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from stocks.models import Exchange, KBar, Tick
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    EXCHANGE_KEY = 'exchange'
+    FROM_KEY = 'from'
+    TO_KEY = 'to'
+
+    help = 'Materialize kbars of a exchange from its stored ticks'
+
+    def add_arguments(self, parser):
+        exchange_choices = [
+            exchange.code for exchange in Exchange.objects.all()
+        ]
+        parser.add_argument(f'--{self.EXCHANGE_KEY}',
+                            required=True, choices=exchange_choices)
+        parser.add_argument(f'--{self.FROM_KEY}', required=True)
+        parser.add_argument(f'--{self.TO_KEY}', required=True)
+
+    def handle(self, *args, **options):
+        exchange = Exchange.objects.get(code=options[self.EXCHANGE_KEY])
+        from_date = pd.to_datetime(options.get(self.FROM_KEY), utc=True)
+        to_date = pd.to_datetime(options.get(self.TO_KEY), utc=True)
+        brokerage_cls = exchange.get_stock_brokerage_class(exchange.code)
+        calendar_index = exchange.calendar_index
+
+        for session in calendar_index.get_sessions(from_date, to_date):
+            date_text = session.strftime('%Y%m%d')
+            tick_qs = (Tick.objects
+                       .filter(stock__exchange=exchange,
+                               ts__gte=calendar_index.get_opens(session),
+                               ts__lte=calendar_index.get_closes(session))
+                       .values('stock_id', *brokerage_cls.TICK_KEYS)
+                       .order_by('stock_id', 'ts'))
+            tick_df = pd.DataFrame.from_records(data=tick_qs, columns=['stock_id', *brokerage_cls.TICK_KEYS])
+            if tick_df.empty:
+                logger.info('%s %s: skipped', exchange.code, date_text)
+                continue
+            tick_df['ts'] = pd.to_datetime(tick_df['ts'], utc=True).dt.tz_convert(brokerage_cls.TIMEZONE)
+
+            kbar_count = 0
+            for stock_id, ticks in tick_df.groupby('stock_id', sort=False):
+                kbars = brokerage_cls.store_kbars(KBar, stock_id, ticks.set_index('ts'))
+                kbar_count += len(kbars)
+            logger.info('%s %s: %d kbars of %d stocks materialized',
+                        exchange.code, date_text, kbar_count, tick_df['stock_id'].nunique())
@@ -0,0 +1,44 @@
+import logging
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from stocks.helpers.panel import SummaryPanel
+from stocks.models import Exchange, DailySummary
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    EXCHANGE_KEY = 'exchange'
+    FROM_KEY = 'from'
+    TO_KEY = 'to'
+
+    help = 'Dump stored daily summaries of a exchange into its summary panel'
+
+    def add_arguments(self, parser):
+        exchange_choices = [
+            exchange.code for exchange in Exchange.objects.all()
+        ]
+        parser.add_argument(f'--{self.EXCHANGE_KEY}',
+                            required=True, choices=exchange_choices)
+        parser.add_argument(f'--{self.FROM_KEY}', required=True)
+        parser.add_argument(f'--{self.TO_KEY}', required=True)
+
+    def handle(self, *args, **options):
+        exchange = Exchange.objects.get(code=options[self.EXCHANGE_KEY])
+        from_date = pd.to_datetime(options.get(self.FROM_KEY), utc=True)
+        to_date = pd.to_datetime(options.get(self.TO_KEY), utc=True)
+        panel = SummaryPanel(exchange)
+
+        for date in exchange.calendar_index.get_sessions(from_date, to_date):
+            date_text = date.strftime('%Y%m%d')
+            summary_qs = (DailySummary.objects
+                          .filter(stock__exchange=exchange, date=date)
+                          .values('stock_id', *SummaryPanel.FIELDS))
+            summary_df = pd.DataFrame.from_records(data=summary_qs, columns=['stock_id', *SummaryPanel.FIELDS])
+            if summary_df.empty:
+                logger.info('%s %s: skipped', exchange.code, date_text)
+                continue
+            panel.write_frame(date, summary_df.set_index('stock_id'))
+            logger.info('%s %s: success', exchange.code, date_text)
@@ -0,0 +1,48 @@
+import logging
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from stocks.helpers.investor import InvestorStreak
+from stocks.helpers.panel import SummaryPanel
+from stocks.models import Exchange, DailySummary
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    EXCHANGE_KEY = 'exchange'
+    FROM_KEY = 'from'
+    TO_KEY = 'to'
+
+    help = 'Recompute investor net volumes and buy streaks of daily summaries'
+
+    def add_arguments(self, parser):
+        exchange_choices = [
+            exchange.code for exchange in Exchange.objects.all()
+        ]
+        parser.add_argument(f'--{self.EXCHANGE_KEY}',
+                            required=True, choices=exchange_choices)
+        parser.add_argument(f'--{self.FROM_KEY}',
+                            help='all stored summaries are filled when omitted')
+        parser.add_argument(f'--{self.TO_KEY}')
+
+    def handle(self, *args, **options):
+        exchange = Exchange.objects.get(code=options[self.EXCHANGE_KEY])
+        from_date_text = options.get(self.FROM_KEY)
+        if from_date_text:
+            from_date = pd.to_datetime(from_date_text, utc=True)
+        else:
+            # summaries stored before the net volumes and streaks were added
+            logger.info('%s: %d net volumes filled', exchange.code, InvestorStreak.fill_net_volumes(exchange))
+            first_date = (DailySummary.objects
+                          .filter(stock__exchange=exchange)
+                          .aggregate(first_date=models.Min('date'))['first_date'])
+            if first_date is None:
+                return
+            from_date = pd.Timestamp(first_date, tz='UTC')
+        to_date_text = options.get(self.TO_KEY)
+        to_date = pd.to_datetime(to_date_text, utc=True) if to_date_text else None
+
+        InvestorStreak.update_streaks(exchange, from_date, to_date, panel=SummaryPanel(exchange))
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.6 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0013_conservativestrategytestrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailysummary',
+            name='foreign_dealer_buy_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='foreign_dealer_net_volume',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='investment_trust_buy_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='investment_trust_net_volume',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='local_dealer_hedge_buy_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='local_dealer_hedge_net_volume',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='local_dealer_proprietary_buy_streak',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='local_dealer_proprietary_net_volume',
+            field=models.IntegerField(null=True),
+        ),
+    ]
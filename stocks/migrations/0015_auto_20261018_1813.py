@@ -0,0 +1,32 @@
+# Generated by Django 3.1.6 on 2026-10-18 18:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0014_auto_20261018_1807'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KBar',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('interval', models.CharField(max_length=10)),
+                ('ts', models.DateTimeField()),
+                ('open', models.FloatField()),
+                ('close', models.FloatField()),
+                ('high', models.FloatField()),
+                ('low', models.FloatField()),
+                ('volume', models.IntegerField()),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kbars', to='stocks.stock')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='kbar',
+            constraint=models.UniqueConstraint(fields=('stock', 'interval', 'ts'), name='unique_kbar'),
+        ),
+    ]
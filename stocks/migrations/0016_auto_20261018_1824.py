@@ -0,0 +1,36 @@
+# Generated by Django 3.1.6 on 2026-10-18 18:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0015_auto_20261018_1813'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackTestRun',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('commit', models.CharField(max_length=255)),
+                ('strategy', models.CharField(max_length=255)),
+                ('parameters', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('is_completed', models.BooleanField(default=False)),
+                ('position', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='backtestrun',
+            constraint=models.UniqueConstraint(fields=('commit', 'strategy', 'parameters', 'date'), name='unique_back_test_run'),
+        ),
+        migrations.AddField(
+            model_name='backtestrecord',
+            name='run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='records', to='stocks.backtestrun'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.6 on 2026-10-18 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0016_auto_20261018_1824'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpoint',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('job', models.CharField(max_length=255)),
+                ('unit', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=16)),
+                ('error', models.TextField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='jobcheckpoint',
+            constraint=models.UniqueConstraint(fields=('job', 'unit'), name='unique_job_checkpoint'),
+        ),
+    ]
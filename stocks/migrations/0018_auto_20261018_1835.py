@@ -0,0 +1,38 @@
+# Generated by Django 3.1.6 on 2026-10-18 18:35
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def drop_duplicate_daily_summaries(apps, schema_editor):
+    # summaries written twice for a (stock, date) would break the unique constraint, only one of them is kept
+    DailySummary = apps.get_model('stocks', 'DailySummary')
+    duplicates = (DailySummary.objects
+                  .values('stock_id', 'date')
+                  .annotate(count=models.Count('id'))
+                  .filter(count__gt=1))
+    for duplicate in duplicates:
+        summary_ids = list(DailySummary.objects
+                           .filter(stock_id=duplicate['stock_id'], date=duplicate['date'])
+                           .order_by('id')
+                           .values_list('id', flat=True))
+        DailySummary.objects.filter(id__in=summary_ids[1:]).delete()
+        logger.info(f'{len(summary_ids) - 1} duplicate summaries of {duplicate["stock_id"]} on {duplicate["date"]} dropped')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0017_auto_20261018_1827'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_daily_summaries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailysummary',
+            constraint=models.UniqueConstraint(fields=('stock', 'date'), name='unique_daily_summary'),
+        ),
+    ]
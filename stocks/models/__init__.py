@@ -1,2 +1,3 @@
-from .atom import Stock, StockCategory, Exchange, Tick
-from .summary import DailySummary, BackTestRecord
+from .atom import Stock, StockCategory, Exchange, Tick, KBar
+from .summary import DailySummary, BackTestRecord, BackTestRun
+from .job import JobCheckpoint
@@ -9,6 +9,8 @@ from trading_calendars import get_calendar
 
 import stocks.helpers.brokerage as brokerages
 import stocks.helpers.crawler as crawlers
+from stocks.helpers.directory import StockDirectory
+from stocks.helpers.trading_calendar import TradingCalendarIndex
 from utils import AESEncoder
 
 
@@ -36,6 +38,7 @@ class Exchange(models.Model):
         self.init_crawler()
         self._brokerage = None
         self._calendar = None
+        self._stock_directory = None
 
     @property
     def crawler(self):
@@ -47,6 +50,16 @@ class Exchange(models.Model):
             self._calendar = get_calendar(self.calendar_code)
         return self._calendar
 
+    @property
+    def calendar_index(self) -> TradingCalendarIndex:
+        return TradingCalendarIndex.get(self.calendar_code)
+
+    @property
+    def stock_directory(self) -> StockDirectory:
+        if self._stock_directory is None:
+            self._stock_directory = StockDirectory(self)
+        return self._stock_directory
+
     @property
     def brokerage(self) -> brokerages.Brokerage:
         if self._brokerage is None:
@@ -90,10 +103,13 @@ class Exchange(models.Model):
         if stocks.exists():
             stock = stocks[0]
             if stock.description is None:
-                stock.description = self.crawler.get_stock_name(code)
+                stock.description = self.get_stock_names([code])[code]
                 stock.save()
             return stock.description
-        return self.crawler.get_stock_name(code)
+        return self.get_stock_names([code])[code]
+
+    def get_stock_names(self, codes) -> dict:
+        return self.stock_directory.get_names(codes)
 
     def get_daily_summary(self, date: datetime.date) -> pd.DataFrame:
         return self.crawler.get_daily_summary(date)
@@ -122,12 +138,12 @@ class Stock(models.Model):
         ]
 
     @staticmethod
-    def get_new_record(exchange: Exchange, code: str):
+    def get_new_record(exchange: Exchange, code: str, description=None):
         return Stock(
             id=uuid4(),
             exchange=exchange,
             code=code,
-            description=exchange.get_stock_name(code)
+            description=exchange.get_stock_name(code) if description is None else description
         )
 
 
@@ -147,3 +163,21 @@ class Tick(models.Model):
             models.Index(fields=['-ts']),
             models.Index(fields=['-ts', 'stock']),
         ]
+
+
+class KBar(models.Model):
+    id = models.UUIDField(primary_key=True)
+    stock = models.ForeignKey(Stock, related_name='kbars', on_delete=models.CASCADE)
+    interval = models.CharField(max_length=10)  # K 線週期
+    ts = models.DateTimeField()  # 起始時間
+    open = models.FloatField()  # 開盤價
+    close = models.FloatField()  # 收盤價
+    high = models.FloatField()  # 最高價
+    low = models.FloatField()  # 最低價
+    volume = models.IntegerField()  # 成交張數
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['stock', 'interval', 'ts'], name='unique_kbar')
+        ]
@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class JobCheckpoint(models.Model):
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    id = models.UUIDField(primary_key=True)
+    job = models.CharField(max_length=255)  # 工作名稱
+    unit = models.CharField(max_length=255)  # 工作單位 (例如日期)
+    status = models.CharField(max_length=16)  # 完成或失敗
+    error = models.TextField(null=True)  # 失敗原因
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'unit'], name='unique_job_checkpoint')
+        ]
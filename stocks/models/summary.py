@@ -27,17 +27,46 @@ class DailySummary(models.Model):
     local_dealer_proprietary_sell_volume = models.IntegerField(null=True)  # 自營商(自有)賣出
     local_dealer_hedge_buy_volume = models.IntegerField(null=True)  # 自營商(避險)買入
     local_dealer_hedge_sell_volume = models.IntegerField(null=True)  # 自營商(避險)賣出
+    foreign_dealer_net_volume = models.IntegerField(null=True)  # 外資買賣超
+    foreign_dealer_buy_streak = models.IntegerField(default=0)  # 外資連續買超日數
+    investment_trust_net_volume = models.IntegerField(null=True)  # 投信買賣超
+    investment_trust_buy_streak = models.IntegerField(default=0)  # 投信連續買超日數
+    local_dealer_proprietary_net_volume = models.IntegerField(null=True)  # 自營商(自有)買賣超
+    local_dealer_proprietary_buy_streak = models.IntegerField(default=0)  # 自營商(自有)連續買超日數
+    local_dealer_hedge_net_volume = models.IntegerField(null=True)  # 自營商(避險)買賣超
+    local_dealer_hedge_buy_streak = models.IntegerField(default=0)  # 自營商(避險)連續買超日數
 
     class Meta:
         indexes = [
             models.Index(fields=['-date']),
             models.Index(fields=['-date', 'stock']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['stock', 'date'], name='unique_daily_summary')
+        ]
+
+
+class BackTestRun(models.Model):
+    id = models.UUIDField(primary_key=True)
+    commit = models.CharField(max_length=255)
+    strategy = models.CharField(max_length=255)  # 回測類別
+    parameters = models.CharField(max_length=255)  # 回測參數 (JSON)
+    date = models.DateField()  # 回測日期
+    is_completed = models.BooleanField(default=False)  # 是否已完成
+    position = models.FloatField(default=0)  # 當日結束時的部位
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['commit', 'strategy', 'parameters', 'date'], name='unique_back_test_run')
+        ]
 
 
 class BackTestRecord(models.Model):
     id = models.UUIDField(primary_key=True)
     commit = models.CharField(max_length=255)
+    run = models.ForeignKey(BackTestRun, related_name='records', null=True, on_delete=models.CASCADE)
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
     price = models.FloatField()
     volume = models.IntegerField()
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+from uuid import UUID, uuid4
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import requests
+from django.test import SimpleTestCase, TestCase
+
+from stocks.helpers.backtest import TwseDayTradeBackTest
+from stocks.helpers.investor import InvestorStreak
+from stocks.helpers.panel import SummaryPanel, SummaryPanelError
+from stocks.helpers.registry import BackTestRunRegistry
+from stocks.helpers.scheduler import CrawlerScheduler
+from stocks.helpers.snapshot import SummarySnapshotCache
+from stocks.helpers.trading_calendar import TradingCalendarIndex
+from stocks.helpers.upsert import BulkStagedUpdate, BulkUpsert
+from stocks.models import BackTestRecord, DailySummary, Exchange, Stock
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # /throttled answers 429 once, /flaky 503 twice and /down always 500, every other path 200
+    hits = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        with self.lock:
+            self.hits.setdefault(path, []).append(time.monotonic())
+            count = len(self.hits[path])
+        if path == '/throttled' and count == 1:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+        elif path == '/flaky' and count <= 2:
+            self.send_response(503)
+        elif path == '/down':
+            self.send_response(500)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class CrawlerSchedulerTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        StubHandler.hits.clear()
+        self.scheduler = CrawlerScheduler(max_workers=4)
+
+    def get_gaps(self, path):
+        hits = StubHandler.hits[path]
+        return [later - earlier for earlier, later in zip(hits, hits[1:])]
+
+    def test_paces_endpoints_independently(self):
+        started_at = time.monotonic()
+        futures = [self.scheduler.submit(self.scheduler.request, 'get', f'{self.base_url}/{path}', interval=0.3)
+                   for _ in range(3) for path in ('a', 'b')]
+        self.assertTrue(all(future.result().ok for future in futures))
+        elapsed = time.monotonic() - started_at
+
+        for path in ('/a', '/b'):
+            self.assertEqual(len(StubHandler.hits[path]), 3)
+            self.assertTrue(all(gap >= 0.28 for gap in self.get_gaps(path)))
+        # both endpoints are fetched along, so the run takes the time of one endpoint
+        self.assertLess(elapsed, 1.2)
+
+    def test_honors_retry_after(self):
+        response = self.scheduler.request('get', f'{self.base_url}/throttled')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(self.get_gaps('/throttled')[0], 0.95)
+
+    def test_recovers_from_unavailable(self):
+        response = self.scheduler.request('get', f'{self.base_url}/flaky', backoff=0.05)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(StubHandler.hits['/flaky']), 3)
+
+    def test_raises_once_retries_are_exhausted(self):
+        with self.assertRaises(requests.HTTPError) as context:
+            self.scheduler.request('get', f'{self.base_url}/down', retry_count=3, backoff=0.05)
+        self.assertEqual(context.exception.response.status_code, 500)
+        self.assertEqual(len(StubHandler.hits['/down']), 3)
+
+    def test_raises_when_unreachable(self):
+        with self.assertRaises(requests.ConnectionError):
+            self.scheduler.request('get', 'http://127.0.0.1:1/unreachable', retry_count=2, backoff=0.05)
+
+
+class StubExchange:
+    # the code and calendar sessions helpers read from an exchange
+    def __init__(self, code='TEST', sessions=None):
+        self.code = code
+        self.calendar_index = SimpleNamespace(
+            sessions=pd.DatetimeIndex(sessions if sessions is not None else pd.bdate_range('2021-01-04', '2021-01-29')))
+
+
+class SummaryPanelTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.panel = SummaryPanel(StubExchange(), root=self.root)
+        self.stock_ids = [UUID(int=i + 1) for i in range(3)]
+
+    def write_day(self, date, stock_ids, closing_prices):
+        frame = pd.DataFrame({'closing_price': closing_prices, 'trade_volume': [1000.0] * len(stock_ids)},
+                             index=stock_ids)
+        self.panel.write_frame(date, frame)
+
+    def test_reads_written_range(self):
+        self.write_day('2021-01-04', self.stock_ids[:2], [10.0, 20.0])
+        self.write_day('2021-01-05', self.stock_ids, [11.0, 21.0, 31.0])
+
+        frames = SummaryPanel(StubExchange(), root=self.root).read_filled_range(
+            ['closing_price'], '2021-01-04', '2021-01-05')
+        closes = frames['closing_price']
+        self.assertEqual(list(closes.columns), self.stock_ids)
+        np.testing.assert_array_equal(closes.to_numpy(), [[10.0, 20.0, np.nan], [11.0, 21.0, 31.0]])
+
+    def test_skips_unfilled_range(self):
+        self.write_day('2021-01-04', self.stock_ids, [10.0, 20.0, 30.0])
+        self.assertIsNone(self.panel.read_filled_range(['closing_price'], '2021-01-04', '2021-01-05'))
+        self.assertIsNone(self.panel.read_filled_snapshot('2021-01-05', ['closing_price']))
+
+    def test_updates_given_fields_only(self):
+        self.write_day('2021-01-04', self.stock_ids, [10.0, 20.0, 30.0])
+        self.panel.write('2021-01-04', self.stock_ids[1:2], {'closing_price': [25.0]}, replace=False)
+
+        snapshot = self.panel.read_filled_snapshot('2021-01-04', ['closing_price', 'trade_volume'])
+        self.assertEqual(snapshot['closing_price'].to_list(), [10.0, 25.0, 30.0])
+        self.assertEqual(snapshot['trade_volume'].to_list(), [1000.0] * 3)
+
+    def test_pads_stocks_added_after_a_field(self):
+        self.write_day('2021-01-04', self.stock_ids[:1], [10.0])
+        new_stock_ids = [UUID(int=i + 100) for i in range(SummaryPanel.STOCK_CAPACITY_STEP)]
+        self.panel.write('2021-01-05', new_stock_ids, {'closing_price': np.ones(len(new_stock_ids))}, replace=False)
+
+        # only the written field grew, the others are read as not written for the new stocks
+        volumes = self.panel.read_range('trade_volume', '2021-01-04', '2021-01-04')
+        self.assertEqual(volumes.shape, (1, 1 + len(new_stock_ids)))
+        self.assertEqual(volumes.iloc[0, 0], 1000.0)
+        self.assertTrue(volumes.iloc[0, 1:].isna().all())
+
+    def test_falls_back_without_field_file(self):
+        self.write_day('2021-01-04', self.stock_ids, [10.0, 20.0, 30.0])
+        os.remove(os.path.join(self.panel.directory, 'closing_price.npy'))
+
+        with self.assertRaises(SummaryPanelError):
+            self.panel.read_range('closing_price', '2021-01-04', '2021-01-04')
+        with self.assertLogs('stocks.helpers.panel', level='WARNING'):
+            self.assertIsNone(self.panel.read_filled_range(['closing_price'], '2021-01-04', '2021-01-04'))
+        with self.assertLogs('stocks.helpers.panel', level='WARNING'):
+            self.assertIsNone(self.panel.read_filled_snapshot('2021-01-04', ['closing_price']))
+
+
+class SummarySnapshotCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        clock = mock.patch('stocks.helpers.snapshot.time', SimpleNamespace(monotonic=lambda: self.now))
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.loads = []
+        loader = mock.patch.object(SummarySnapshotCache, 'load_snapshot', self.load_snapshot)
+        loader.start()
+        self.addCleanup(loader.stop)
+        self.exchange = StubExchange()
+
+    def load_snapshot(self, exchange, date):
+        self.loads.append(date)
+        return pd.DataFrame({'closing_price': np.full(10, float(len(self.loads)))},
+                            index=pd.Index([UUID(int=i + 1) for i in range(10)], name='stock_id'))
+
+    def test_reuses_snapshot_within_ttl(self):
+        cache = SummarySnapshotCache(max_bytes=1 << 20, ttl=60)
+        first = cache.get(self.exchange, '2021-01-04')
+        self.now = 59.0
+        self.assertIs(cache.get(self.exchange, '2021-01-04'), first)
+        self.assertEqual(len(self.loads), 1)
+
+    def test_reloads_expired_snapshot(self):
+        cache = SummarySnapshotCache(max_bytes=1 << 20, ttl=60)
+        cache.get(self.exchange, '2021-01-04')
+        total_bytes = cache.total_bytes
+        self.now = 60.0
+        snapshot = cache.get(self.exchange, '2021-01-04')
+        self.assertEqual(len(self.loads), 2)
+        self.assertEqual(snapshot['closing_price'].iloc[0], 2.0)
+        self.assertEqual(cache.total_bytes, total_bytes)
+
+    def test_evicts_least_recently_used(self):
+        cache = SummarySnapshotCache(max_bytes=1, ttl=60)
+        cache.get(self.exchange, '2021-01-04')
+        cache.get(self.exchange, '2021-01-05')
+        cache.get(self.exchange, '2021-01-05')
+        self.assertEqual(len(self.loads), 2)
+        cache.get(self.exchange, '2021-01-04')
+        self.assertEqual(len(self.loads), 3)
+
+    def test_skips_empty_snapshot(self):
+        cache = SummarySnapshotCache(max_bytes=1 << 20, ttl=60)
+        with mock.patch.object(SummarySnapshotCache, 'load_snapshot', return_value=pd.DataFrame()) as load_snapshot:
+            cache.get(self.exchange, '2021-01-04')
+            cache.get(self.exchange, '2021-01-04')
+        self.assertEqual(load_snapshot.call_count, 2)
+        self.assertEqual(cache.total_bytes, 0)
+
+
+class TradingCalendarIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        # weekdays of January 2021 but a holiday on Wednesday 2021/01/13, opening 09:00 and closing 13:30 in Taipei
+        sessions = pd.bdate_range('2021-01-04', '2021-01-29', tz='UTC')
+        sessions = sessions[sessions != pd.Timestamp('2021-01-13', tz='UTC')]
+        self.calendar = SimpleNamespace(all_sessions=sessions,
+                                        opens=pd.Series(sessions + pd.Timedelta(hours=1), index=sessions),
+                                        closes=pd.Series(sessions + pd.Timedelta(hours=5, minutes=30), index=sessions))
+        self.index = TradingCalendarIndex(self.calendar)
+
+    @staticmethod
+    def to_session(date):
+        return pd.Timestamp(date, tz='UTC')
+
+    def test_shifts_sessions(self):
+        self.assertEqual(self.index.shift('2021-01-12', 1), self.to_session('2021-01-14'))
+        self.assertEqual(self.index.shift('2021-01-14', -1), self.to_session('2021-01-12'))
+        self.assertEqual(self.index.shift('2021-01-08', 0), self.to_session('2021-01-08'))
+
+    def test_shifts_closed_days_from_previous_session(self):
+        self.assertEqual(self.index.shift('2021-01-13', 1), self.to_session('2021-01-14'))
+        self.assertEqual(self.index.shift('2021-01-10', -1), self.to_session('2021-01-07'))
+
+    def test_shifts_out_of_calendar_to_nat(self):
+        self.assertTrue(pd.isna(self.index.shift('2021-01-04', -1)))
+        self.assertTrue(pd.isna(self.index.shift('2021-01-29', 1)))
+        shifted = self.index.shift(pd.DatetimeIndex(['2021-01-05', '2021-01-28']), 2)
+        self.assertEqual(shifted[0], self.to_session('2021-01-07'))
+        self.assertTrue(pd.isna(shifted[1]))
+
+    def test_windows_sessions(self):
+        window = self.index.window('2021-01-14', 3)
+        self.assertEqual(list(window), [self.to_session(date) for date in ('2021-01-11', '2021-01-12', '2021-01-14')])
+        self.assertEqual(list(self.index.window('2021-01-13', 1)), [self.to_session('2021-01-12')])
+        self.assertEqual(len(self.index.window('2021-01-05', 5)), 2)
+
+    def test_matches_calendar_slices(self):
+        for date in pd.date_range('2021-01-06', '2021-01-31'):
+            sessions = self.calendar.all_sessions[self.calendar.all_sessions <= self.to_session(date)]
+            self.assertEqual(list(self.index.window(date, 4)), list(sessions[-4:]))
+            self.assertEqual(self.index.shift(date, -2), sessions[-3])
+
+
+class DayTradeReplayTest(SimpleTestCase):
+
+    def setUp(self):
+        analyzer = mock.patch('stocks.helpers.analyzer.TwseAnalyzer', lambda: SimpleNamespace(MIN_RSI=30, MAX_RSI=70))
+        analyzer.start()
+        self.addCleanup(analyzer.stop)
+        self.stock = SimpleNamespace(id=UUID(int=1), code='1101')
+
+    @staticmethod
+    def get_session(seed):
+        rng = np.random.default_rng(seed)
+        open_ts = pd.Timestamp('2021-01-04 09:00', tz='Asia/Taipei')
+        kbars = pd.DataFrame({'rsi': rng.uniform(10, 90, 270), 'macd_hist': rng.normal(0, 1, 270)},
+                             index=pd.date_range(open_ts, periods=270, freq='1min'))
+        # ticks from before the first kbar to after the final out at 13:00
+        offsets = np.sort(rng.integers(-300, 270 * 60, 600))
+        ticks = pd.DataFrame({'close': rng.normal(100, 1, 600).round(1), 'volume': rng.integers(1, 5, 600)},
+                             index=open_ts + pd.to_timedelta(offsets, unit='s'))
+        return kbars, ticks
+
+    def replay(self, kbars, ticks, vectorized):
+        back_test = TwseDayTradeBackTest(vectorized=vectorized)
+        back_test._kbars[self.stock.id] = kbars  # pylint: disable=protected-access
+        back_test._collected_records = []  # pylint: disable=protected-access
+        back_test.replay(self.stock, ticks)
+        return back_test._collected_records, back_test._position  # pylint: disable=protected-access
+
+    def test_replays_like_react(self):
+        for seed in range(5):
+            kbars, ticks = self.get_session(seed)
+            records, position = self.replay(kbars, ticks, vectorized=True)
+            self.assertTrue(records)
+            self.assertEqual((records, position), self.replay(kbars, ticks, vectorized=False))
+
+    def test_replays_without_kbars(self):
+        kbars, ticks = self.get_session(0)
+        self.assertEqual(self.replay(kbars.iloc[:0], ticks, vectorized=True), ([], 0))
+
+
+class BackTestRunRegistryTest(TestCase):
+
+    def setUp(self):
+        exchange = Exchange.objects.create(id=uuid4(), code='TWSE', calendar_code='XTAI')
+        self.stock = Stock.objects.create(id=uuid4(), exchange=exchange, code='1101')
+        self.registry = BackTestRunRegistry('abc', 'TwseDayTradeBackTest', {'min_rsi': 30, 'max_rsi': 70})
+        self.sessions = [pd.Timestamp(date, tz='UTC') for date in ('2021-01-04', '2021-01-05')]
+
+    def add_record(self, run):
+        BackTestRecord.objects.create(id=uuid4(), commit='abc', run=run, stock=self.stock, price=10.0, volume=1000,
+                                      ts=self.sessions[0] + pd.Timedelta(hours=1))
+
+    def test_resumes_completed_runs(self):
+        self.registry.complete(self.registry.begin(self.sessions[0]), 1000)
+        self.registry.begin(self.sessions[1])
+
+        completed_runs = self.registry.get_completed_runs(self.sessions)
+        self.assertEqual(list(completed_runs), [datetime.date(2021, 1, 4)])
+        self.assertEqual(completed_runs[datetime.date(2021, 1, 4)].position, 1000)
+
+    def test_drops_records_of_unfinished_run(self):
+        run = self.registry.begin(self.sessions[0])
+        self.add_record(run)
+
+        rerun = self.registry.begin(self.sessions[0])
+        self.assertEqual(rerun.id, run.id)
+        self.assertFalse(rerun.records.exists())
+        self.assertFalse(self.registry.get_completed_runs(self.sessions))
+
+    def test_keys_runs_by_parameters(self):
+        self.registry.complete(self.registry.begin(self.sessions[0]), 0)
+
+        reordered = BackTestRunRegistry('abc', 'TwseDayTradeBackTest', {'max_rsi': 70, 'min_rsi': 30})
+        self.assertEqual(len(reordered.get_completed_runs(self.sessions)), 1)
+        for registry in (BackTestRunRegistry('abc', 'TwseDayTradeBackTest', {'min_rsi': 20, 'max_rsi': 70}),
+                         BackTestRunRegistry('def', 'TwseDayTradeBackTest', {'min_rsi': 30, 'max_rsi': 70})):
+            self.assertFalse(registry.get_completed_runs(self.sessions))
+
+    def test_back_test_skips_completed_runs(self):
+        with mock.patch('stocks.helpers.analyzer.TwseAnalyzer', lambda: SimpleNamespace(MIN_RSI=30, MAX_RSI=70)):
+            back_test = TwseDayTradeBackTest()
+            rerun_back_test = TwseDayTradeBackTest(rerun=True)
+        registry = back_test._registry  # pylint: disable=protected-access
+        registry.complete(registry.begin(self.sessions[0]), 1000)
+
+        completed_runs = back_test.get_completed_runs(self.sessions)
+        self.assertTrue(back_test.skip_session(self.sessions[0], completed_runs))
+        self.assertEqual(back_test._position, 1000)  # pylint: disable=protected-access
+        self.assertFalse(back_test.skip_session(self.sessions[1], completed_runs))
+        self.assertEqual(rerun_back_test.get_completed_runs(self.sessions), {})
+
+
+class DailySummaryTestCase(TestCase):
+
+    def setUp(self):
+        exchange = Exchange.objects.create(id=uuid4(), code='TWSE', calendar_code='XTAI')
+        self.stocks = [Stock.objects.create(id=uuid4(), exchange=exchange, code=code) for code in ('1101', '2330')]
+        self.stock_ids = [stock.id for stock in self.stocks]
+        self.date = datetime.date(2021, 1, 4)
+
+    def get_columns(self, closing_prices, trade_volumes, **columns):
+        # summaries as the dump writes them, investor keys included
+        count = len(closing_prices)
+        return {
+            'id': BulkUpsert.get_uuids(count),
+            'date': self.date,
+            'stock': self.stock_ids[:count],
+            'closing_price': np.asarray(closing_prices, dtype=float),
+            'trade_volume': np.asarray(trade_volumes, dtype=float),
+            **{key: np.zeros(count) for key in InvestorStreak.get_keys()},
+            **columns,
+        }
+
+    def get_summaries(self, *fields):
+        return list(DailySummary.objects.order_by('stock__code').values_list(*fields))
+
+
+class BulkUpsertTest(DailySummaryTestCase):
+
+    def test_draws_uuids(self):
+        uuids = [UUID(hex=value) for value in BulkUpsert.get_uuids(100)]
+        self.assertEqual(len(set(uuids)), 100)
+        self.assertTrue(all(value.version == 4 for value in uuids))
+
+    def test_inserts_nan_as_null(self):
+        upsert = BulkUpsert(DailySummary, unique_fields=('stock', 'date'))
+        self.assertEqual(upsert.execute(self.get_columns([10.5, np.nan], [1000, np.nan])), 2)
+        self.assertEqual(self.get_summaries('closing_price', 'trade_volume'), [(10.5, 1000), (None, None)])
+
+    def test_updates_existing_rows(self):
+        upsert = BulkUpsert(DailySummary, unique_fields=('stock', 'date'))
+        upsert.execute(self.get_columns([10.5, 20.0], [1000, 2000]))
+        ids = self.get_summaries('id')
+
+        upsert.execute(self.get_columns([11.0, 21.0], [1100, 2100]))
+        self.assertEqual(self.get_summaries('id'), ids)
+        self.assertEqual(self.get_summaries('closing_price', 'trade_volume'), [(11.0, 1100), (21.0, 2100)])
+
+    def test_writes_in_batches(self):
+        upsert = BulkUpsert(DailySummary, unique_fields=('stock', 'date'))
+        with mock.patch.object(BulkUpsert, 'BATCH_SIZE', 1):
+            upsert.execute(self.get_columns([10.5, 20.0], [1000, 2000]))
+        self.assertEqual(DailySummary.objects.count(), 2)
+
+
+class BulkStagedUpdateTest(DailySummaryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        BulkUpsert(DailySummary, unique_fields=('stock', 'date')).execute(self.get_columns([10.5, 20.0], [1000, 2000]))
+        self.update = BulkStagedUpdate(DailySummary, unique_fields=('stock', 'date'))
+
+    def test_updates_given_columns_only(self):
+        updated_count = self.update.execute({'stock': self.stock_ids, 'date': self.date,
+                                             'closing_price': np.array([11.0, np.nan])})
+        self.assertEqual(updated_count, 2)
+        self.assertEqual(self.get_summaries('closing_price', 'trade_volume'), [(11.0, 1000), (None, 2000)])
+
+    def test_ignores_rows_without_summary(self):
+        updated_count = self.update.execute({'stock': self.stock_ids, 'date': datetime.date(2021, 1, 5),
+                                             'closing_price': np.array([11.0, 21.0])})
+        self.assertEqual(updated_count, 0)
+        self.assertEqual(self.get_summaries('closing_price'), [(10.5,), (20.0,)])
+
+    def test_updates_again_in_the_same_connection(self):
+        # the staging table of a previous update is dropped, whatever columns it had
+        self.update.execute({'stock': self.stock_ids[:1], 'date': self.date, 'trade_volume': np.array([1100])})
+        self.update.execute({'stock': self.stock_ids[1:], 'date': self.date, 'closing_price': np.array([21.0])})
+        self.assertEqual(self.get_summaries('closing_price', 'trade_volume'), [(10.5, 1100), (21.0, 2000)])
@@ -56,7 +56,7 @@ class StockViewSet(viewsets.ViewSet):
         date = pd.to_datetime(request.query_params.get('date'), utc=True)
         operator = self.parse_operator(f'day trade {exchange_code}')
 
-        if date not in operator.analyzer.calendar.opens:
+        if not operator.analyzer.calendar_index.is_open(date):
             logger.info('%s is closed on %s', exchange_code, date)
             return response.Response({'data': []})
 